@@ -1,12 +1,9 @@
-from flask import Flask
 from configuration import create_application
-from configuration.dbInitialization import db
 
+# the schema is created and upgraded by an explicit command, not when the application starts:
+#   flask --app app upgrade-db
+# the routes are listed by: flask --app app routes
 app = create_application()
-with app.app_context():
-    db.create_all()
-with app.app_context():
-    print(app.url_map)
 
 
 if __name__ == '__main__' :
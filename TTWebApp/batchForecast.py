@@ -0,0 +1,101 @@
+import argparse
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from sqlalchemy import select
+from configuration import create_application
+from configuration.dbInitialization import db
+from configuration.models import User, UsageHistory, Recharge
+from configuration.forecasting import forecast_user, recommend_plans
+from configuration.precomputed import store_predictions
+from configuration.planCatalog import plan_catalog
+from configuration.predictionPipeline import recharge_forecaster, forecaster_version
+from configuration.migrations import upgrade_database
+
+# offline job precomputing the /predict forecasts and plan recommendations of every user into the prediction table
+# usage: python batchForecast.py [--workers N] [--chunksize N]
+
+
+# load both history tables in one pass each, grouped by user, along with the version stamp of each user's history
+def load_histories():
+    usage = defaultdict(list)
+    usage_max_id = {}
+    rows = db.session.execute(select(UsageHistory.id, UsageHistory.userId, UsageHistory.usageTimestamp, UsageHistory.callsMinutes,
+                                     UsageHistory.smsCount, UsageHistory.dataUsageMB).order_by(UsageHistory.id))
+    for row in rows:
+        usage[row.userId].append((row.usageTimestamp, row.callsMinutes, row.smsCount, row.dataUsageMB))
+        usage_max_id[row.userId] = row.id
+
+    recharges = defaultdict(list)
+    recharge_max_id = {}
+    rows = db.session.execute(select(Recharge.id, Recharge.userId, Recharge.rechargeDate, Recharge.rechargeAmount,
+                                     Recharge.bonusAdded, Recharge.dataAddedMB).order_by(Recharge.id))
+    for row in rows:
+        recharges[row.userId].append((row.rechargeDate, row.rechargeAmount, row.bonusAdded, row.dataAddedMB))
+        recharge_max_id[row.userId] = row.id
+
+    return usage, usage_max_id, recharges, recharge_max_id
+
+
+def _forecast(job):
+    user_id, usage_records, recharge_records, bonus_plan, forecaster = job
+    return user_id, forecast_user(usage_records, recharge_records, bonus_plan, *forecaster)
+
+
+def run(workers, chunksize):
+    usage, usage_max_id, recharges, recharge_max_id = load_histories()
+    bonus_plans = dict(db.session.execute(select(User.id, User.bonusPlan)).all())
+    plans = plan_catalog.snapshot()
+    forecaster = recharge_forecaster()
+
+    # users without usage history get no prediction, same as the /predict route
+    jobs = [(user_id, usage[user_id], recharges.get(user_id, []), bonus_plans.get(user_id, 0), forecaster)
+            for user_id in usage if user_id in bonus_plans]
+
+    computed_at = datetime.now()
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for user_id, forecast in pool.map(_forecast, jobs, chunksize=chunksize):
+            best_monetary_plan, best_data_plan = recommend_plans(forecast, plans)
+            rows.append({
+                'userId': user_id,
+                'computedAt': computed_at,
+                'usageCount': len(usage[user_id]),
+                'usageMaxId': usage_max_id[user_id],
+                'rechargeCount': len(recharges.get(user_id, [])),
+                'rechargeMaxId': recharge_max_id.get(user_id),
+                'predictedCalls': float(forecast['predicted_calls']),
+                'predictedSms': float(forecast['predicted_sms']),
+                'predictedData': float(forecast['predicted_data']),
+                'predictedRechargeMonetary': _optional_float(forecast.get('predicted_recharge_monetary')),
+                'predictedRechargeData': _optional_float(forecast.get('predicted_recharge_data')),
+                'bonusPrediction': _optional_float(forecast.get('bonus_prediction')),
+                'bestMonetaryPlanId': best_monetary_plan.id if best_monetary_plan else None,
+                'bestDataPlanId': best_data_plan.id if best_data_plan else None,
+                'plansVersion': plans.fingerprint,
+                'forecaster': forecaster_version(*forecaster),
+                'bonusPlan': bonus_plans[user_id],
+            })
+
+    store_predictions(rows)
+    return len(rows)
+
+
+def _optional_float(value):
+    return float(value) if value is not None else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute the /predict forecasts of all users.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('--chunksize', type=int, default=16, help="users sent to a worker at once")
+    args = parser.parse_args()
+
+    app = create_application()
+    with app.app_context():
+        upgrade_database()
+        start = time.perf_counter()
+        count = run(args.workers, args.chunksize)
+        print(f"Precomputed predictions for {count} users in {time.perf_counter() - start:.2f}s")
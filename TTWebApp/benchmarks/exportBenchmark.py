@@ -0,0 +1,88 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import insert
+from configuration import create_application
+from configuration.dbInitialization import db
+from configuration.models import User, UsageHistory
+
+# compares the paginated JSON listing of /api/usageHistory with the NDJSON streaming export on a synthetic table,
+# each mode runs in a fresh process so its peak RSS is measured on its own
+# usage (from the TTWebApp folder): python -m benchmarks.exportBenchmark [--rows N]
+
+
+def create_database(path, rows, users=1000, seed=0):
+    app = create_application({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 12, 1)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User), [{'phoneNumber': str(90000000 + i), 'bonusPlan': 2} for i in range(users)])
+        for offset in range(0, rows, 50000):
+            count = min(50000, rows - offset)
+            db.session.execute(insert(UsageHistory), [
+                {'userId': int(user_id), 'usageTimestamp': start + timedelta(days=int(day)), 'callsMinutes': int(calls),
+                 'smsCount': int(sms), 'dataUsageMB': float(data)}
+                for user_id, day, calls, sms, data in zip(rng.integers(1, users + 1, count), rng.integers(0, 60, count),
+                                                          rng.poisson(15, count), rng.poisson(5, count), rng.normal(500, 150, count))
+            ])
+        db.session.commit()
+
+
+def run_mode(path, mode, results):
+    app = create_application({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    client = app.test_client()
+    client.get('/api/usageHistory?limit=1')  # warm up
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+    if mode == 'ndjson':
+        response = client.get('/api/usageHistory?stream=1', buffered=False)
+        for chunk in response.response:
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(chunk)
+        response.close()
+    else:
+        cursor = 0
+        while cursor is not None:
+            response = client.get(f'/api/usageHistory?after_id={cursor}&limit=1000')
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(response.data)
+            cursor = response.json['next_cursor']
+
+    results[mode] = {
+        'time': time.perf_counter() - start,
+        'first_byte': first_byte,
+        'size': size,
+        'rss_growth_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the usage history export.")
+    parser.add_argument('--rows', type=int, default=500000, help="synthetic usage history rows")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'exportBenchmark.db')
+        create_database(path, args.rows)
+
+        results = multiprocessing.Manager().dict()
+        for mode in ['paginated json', 'ndjson']:
+            process = multiprocessing.Process(target=run_mode, args=(path, mode, results))
+            process.start()
+            process.join()
+
+        print(f"{args.rows} usage history rows")
+        for mode, result in results.items():
+            print(f"  {mode:15} total {result['time']:7.2f}s  first byte {result['first_byte'] * 1000:8.1f} ms"
+                  f"  {result['size'] / 1e6:7.1f} MB sent  peak RSS growth {result['rss_growth_mb']:7.1f} MB")
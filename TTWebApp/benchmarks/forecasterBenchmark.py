@@ -0,0 +1,88 @@
+import argparse
+import json
+import pickle
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from configuration.forecasters import RECHARGE_FORECASTERS, make_forecaster
+
+# compares the recharge forecaster backends on the simulated recharge history: latency of a fit and forecast, memory, and error
+# the error is measured by rolling origin: each recharge day of a user (after the first min_days) is forecast from the days before it
+# usage (from the TTWebApp folder): python -m benchmarks.forecasterBenchmark [--min-days N] [--synthetic-users N]
+
+TARGETS = ['rechargeAmount', 'dataAddedMB']
+
+
+def load_recharges(path):
+    data = pd.DataFrame(json.load(open(path)))
+    data['rechargeDate'] = pd.to_datetime(data['rechargeDate'])
+    data['days_since_first_recharge'] = (data['rechargeDate'] - data.groupby('userId')['rechargeDate'].transform('min')).dt.days
+    return data[['userId', 'days_since_first_recharge'] + TARGETS]
+
+
+def synthetic_recharges(users, days, seed=0):
+    # a weekly pattern: bigger recharges at the start of the week, a data recharge every other week
+    rng = np.random.default_rng(seed)
+    day = np.tile(np.arange(days), users)
+    keep = rng.random(users * days) < 0.4
+    return pd.DataFrame({
+        'userId': np.repeat(np.arange(users), days),
+        'days_since_first_recharge': day,
+        'rechargeAmount': np.round(np.where(day % 7 == 0, 20.0, 5.0) + rng.normal(0, 1, users * days), 3),
+        'dataAddedMB': np.where(day % 14 == 0, 1024.0, 0.0),
+    })[keep]
+
+
+def splits(data, min_days):
+    """(training rows, forecast day, actual values of that day) for every user and every day after their first min_days days."""
+    for _, user_data in data.groupby('userId'):
+        days = np.unique(user_data['days_since_first_recharge'])
+        for day in days[min_days:]:
+            actual = user_data.loc[user_data['days_since_first_recharge'] == day, TARGETS].mean().to_numpy()
+            yield user_data[user_data['days_since_first_recharge'] < day], day, actual
+
+
+def fit_and_forecast(name, training, day):
+    X = training[['days_since_first_recharge']].to_numpy()
+    models = [make_forecaster(name).fit(X, training[target].to_numpy()) for target in TARGETS]
+    return models, np.array([model.predict([[day]])[0] for model in models])
+
+
+def evaluate(name, cases):
+    latencies, errors = [], []
+    for training, day, actual in cases:
+        start = time.perf_counter()
+        _, forecast = fit_and_forecast(name, training, day)
+        latencies.append(time.perf_counter() - start)
+        errors.append(np.abs(forecast - actual))
+
+    # memory of one model pair fitted on the longest history: peak allocated while fitting and pickled size
+    training, day, _ = max(cases, key=lambda case: len(case[0]))
+    tracemalloc.start()
+    models, _ = fit_and_forecast(name, training, day)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    size = len(pickle.dumps(models, protocol=pickle.HIGHEST_PROTOCOL))
+    return np.median(latencies), peak, size, np.mean(errors, axis=0)
+
+
+def report(title, data, min_days):
+    cases = list(splits(data, min_days))
+    print(f"{title}: {data['userId'].nunique()} users, {len(data)} recharges, {len(cases)} forecast days")
+    print(f"  {'backend':24}{'fit+forecast':>14}{'peak memory':>14}{'pickled':>12}{'MAE amount':>13}{'MAE data MB':>13}")
+    for name in RECHARGE_FORECASTERS:
+        latency, peak, size, (amount_error, data_error) = evaluate(name, cases)
+        print(f"  {name:24}{latency * 1000:11.2f} ms{peak / 1024:11.1f} kB{size / 1024:9.1f} kB{amount_error:13.3f}{data_error:13.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the recharge forecaster backends.")
+    parser.add_argument('--recharges', default='dataSimulation/recharge_history.json', help="recharge history json file")
+    parser.add_argument('--min-days', type=int, default=3, help="recharge days of history before the first forecast")
+    parser.add_argument('--synthetic-users', type=int, default=10, help="users of the synthetic history")
+    parser.add_argument('--synthetic-days', type=int, default=60, help="days of history per synthetic user")
+    args = parser.parse_args()
+
+    report("simulated history", load_recharges(args.recharges), args.min_days)
+    report("synthetic weekly history", synthetic_recharges(args.synthetic_users, args.synthetic_days), args.min_days)
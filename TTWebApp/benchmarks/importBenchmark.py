@@ -0,0 +1,59 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# cold start guard of the web application: imports configuration and calls create_application() in fresh interpreters under
+# python -X importtime, reports the slowest imports and fails when the analytics libraries are loaded at startup (they must
+# only load on first use) or when the cold start exceeds the time budget
+# usage (from the TTWebApp folder): python -m benchmarks.importBenchmark [--repeat N] [--budget-ms MS]
+
+LAZY_MODULES = ['pandas', 'sklearn', 'scipy', 'geopy']
+
+COLD_START = f"""
+import json, sys, time
+start = time.perf_counter()
+from configuration import create_application
+create_application()
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))
+"""
+
+
+def cold_start():
+    """Run one cold start, returns (seconds, lazy modules loaded, {module: cumulative import microseconds})."""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', COLD_START], capture_output=True, text=True, check=True)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    imports = {}
+    for line in process.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if line.startswith('import time:') and not line.rstrip().endswith('imported package'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            imports[name[1:].rstrip()] = int(cumulative)
+    return result['seconds'], result['loaded'], imports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure and guard the cold start time of create_application().")
+    parser.add_argument('--repeat', type=int, default=5, help="cold starts, the best one is reported")
+    parser.add_argument('--budget-ms', type=float, default=1500, help="maximum cold start time")
+    parser.add_argument('--top', type=int, default=10, help="slowest imports shown")
+    args = parser.parse_args()
+
+    runs = [cold_start() for _ in range(args.repeat)]
+    seconds, loaded, imports = min(runs, key=lambda run: run[0])
+
+    print(f"create_application() cold start: best {seconds * 1000:.1f} ms over {args.repeat} runs")
+    # the names are indented by two spaces per import depth, the direct imports of configuration are at depth 1
+    shallow = sorted(((time, name) for name, time in imports.items() if len(name) - len(name.lstrip()) <= 2), reverse=True)
+    for time, name in shallow[:args.top]:
+        print(f"  {time / 1000:9.1f} ms  {name.strip()}")
+
+    failures = []
+    if loaded:
+        failures.append(f"loaded at startup: {', '.join(loaded)}")
+    if seconds * 1000 > args.budget_ms:
+        failures.append(f"cold start over the {args.budget_ms:.0f} ms budget")
+    if failures:
+        sys.exit("FAILED: " + "; ".join(failures))
+    print("OK: no analytics library loaded at startup, within budget")
@@ -0,0 +1,112 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from sqlalchemy import event, func, insert, select
+from werkzeug.security import generate_password_hash
+from configuration import create_application
+from configuration.dbInitialization import db
+from configuration.models import User, Question, Answer
+from configuration.queryBudget import QueryBudgetExceeded
+
+# checks the SQL statement budgets of the question pages (queryBudget.py) and times the pages: they are rendered with TESTING set,
+# so a page issuing more statements than its @query_budget raises QueryBudgetExceeded (e.g. a template lazily loading the author
+# of every row), at growing numbers of questions and answers, the statements of a page must not grow with the rows
+# usage (from the TTWebApp folder): python -m benchmarks.pageBenchmark [--sizes N N ...] [--users N] [--repeat N]
+
+PASSWORD = 'benchmarkpassword'
+KEYWORD = 'recharge'
+PAGES = [
+    ('questions', '/questions'),
+    ('questions', '/questions?questions_page=2'),
+    ('questions', f'/questions?keyword={KEYWORD}'),
+    ('questions', f'/questions?keyword={KEYWORD}&page=2&questions_page=2'),
+    ('answers', '/question/1'),
+    ('answers', '/question/1?page=2'),
+]
+
+
+def add_users(count):
+    db.session.execute(insert(User), [
+        {'id': user_id, 'phoneNumber': str(90000000 + user_id), 'username': f'user{user_id}', 'bonusPlan': 2,
+         'passwordHash': generate_password_hash(PASSWORD, method='pbkdf2:sha256') if user_id == 1 else None}
+        for user_id in range(1, count + 1)
+    ])
+    db.session.commit()
+
+
+def add_questions(count, users):
+    """Questions of every user in turn, each one with an answer of each of the next three users."""
+    first = db.session.execute(select(func.count(Question.id))).scalar() + 1
+    db.session.execute(insert(Question), [
+        {'id': question_id, 'userId': question_id % users + 1, 'content': f'how do I {KEYWORD} my mobile data plan number {question_id}?'}
+        for question_id in range(first, first + count)
+    ])
+    db.session.execute(insert(Answer), [
+        {'questionId': question_id, 'userId': (question_id + offset) % users + 1, 'content': f'answer {offset} of {question_id}'}
+        for question_id in range(first, first + count) for offset in range(1, 4)
+    ])
+    db.session.commit()
+
+
+def add_answers(question_id, count, users):
+    db.session.execute(insert(Answer), [
+        {'questionId': question_id, 'userId': index % users + 1, 'content': f'another answer {index}'} for index in range(count)
+    ])
+    db.session.commit()
+
+
+def measure(client, statements, url, repeat):
+    """Statements and best time of a page, the budget is checked by the app (QueryBudgetExceeded propagates in TESTING)."""
+    best = float('inf')
+    for _ in range(repeat):
+        statements.clear()
+        start = time.perf_counter()
+        response = client.get(url)
+        best = min(best, time.perf_counter() - start)
+        assert response.status_code == 200, f"{url} answered {response.status_code}"
+    return len(statements), best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the SQL statement budgets of the question pages and time them.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help="numbers of questions")
+    parser.add_argument('--users', type=int, default=200, help="authors of the questions and answers")
+    parser.add_argument('--repeat', type=int, default=5, help="requests of each page, the best time is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_application({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'pageBenchmark.db')}", 'TESTING': True})
+        with app.app_context():
+            db.create_all()
+            statements = []
+            event.listen(db.engine, 'before_cursor_execute', lambda *_: statements.append(1))
+            add_users(args.users)
+
+            client = app.test_client()
+            response = client.post('/login', data={'phoneNumber': '90000001', 'password': PASSWORD})
+            assert response.status_code == 302, "login failed"
+
+            counts = {}
+            total = 0
+            print(f"  {'questions':>10}  {'page':54}{'statements':>11}{'budget':>8}{'time':>12}")
+            for size in sorted(args.sizes):
+                add_questions(size - total, args.users)
+                if total == 0:
+                    # enough answers on the first question for a second page
+                    add_answers(1, 100, args.users)
+                total = size
+                for endpoint, url in PAGES:
+                    budget = app.view_functions[f'blp.{endpoint}'].query_budget
+                    try:
+                        count, seconds = measure(client, statements, url, args.repeat)
+                    except QueryBudgetExceeded as error:
+                        print(f"OVER BUDGET: {error}")
+                        sys.exit(1)
+                    counts.setdefault(url, set()).add(count)
+                    print(f"  {size:>10}  {url:54}{count:>11}{budget:>8}{seconds * 1000:9.2f} ms")
+
+            growing = [url for url, seen in counts.items() if len(seen) > 1]
+            print("statements do not grow with the rows, all pages within their budgets" if not growing
+                  else f"STATEMENTS GROW with the rows on: {', '.join(growing)}")
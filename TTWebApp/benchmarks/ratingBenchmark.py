@@ -0,0 +1,88 @@
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import insert
+from configuration import create_application
+from configuration.dbInitialization import db
+from configuration.models import User, Balance
+from configuration.usageRating import event_costs, waterfall, rate_usage
+
+# throughput of the usage rating in events per second: the NumPy waterfall of usageRating.py against the event by event loop of
+# dataSimulation/simulate.py (their accepted events are compared), then rate_usage with its balance reads and bulk update on SQLite
+# usage (from the TTWebApp folder): python -m benchmarks.ratingBenchmark [--events N] [--users N]
+
+
+def synthetic_events(events, users, seed=0):
+    rng = np.random.default_rng(seed)
+    user_ids = rng.integers(1, users + 1, events)
+    timestamps = np.datetime64('2024-12-01') + rng.integers(0, 60 * 24 * 3600, events).astype('timedelta64[s]')
+    calls, sms = rng.integers(0, 31, events), rng.integers(0, 11, events)
+    # some users run out of funds during the batch, so events get rejected
+    funds = {user: (float(bonus), float(monetary)) for user, bonus, monetary in
+             zip(range(1, users + 1), rng.uniform(0, 20, users), rng.uniform(0, 40, users))}
+    return user_ids, timestamps, calls, sms, funds
+
+
+def sequential(user_ids, timestamps, costs, funds):
+    """The rule of simulate.py, one event at a time in timestamp order."""
+    balances = dict(funds)
+    accepted = np.zeros(len(costs), dtype=bool)
+    for index in np.lexsort((np.arange(len(costs)), timestamps, user_ids)):
+        user, cost = int(user_ids[index]), costs[index]
+        if user not in balances:
+            continue
+        bonus, monetary = balances[user]
+        if bonus >= cost:
+            balances[user] = (bonus - cost, monetary)
+        elif bonus + monetary >= cost:
+            balances[user] = (0, monetary - (cost - bonus))
+        else:
+            continue
+        accepted[index] = True
+    return accepted
+
+
+def timed(function, *arguments):
+    start = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - start
+
+
+def rate_database(path, user_ids, timestamps, calls, sms, funds):
+    app = create_application({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User), [{'id': user, 'phoneNumber': str(90000000 + user), 'bonusPlan': 2} for user in funds])
+        db.session.execute(insert(Balance), [{'userId': user, 'bonusBalance': bonus, 'monetaryBalance': monetary}
+                                             for user, (bonus, monetary) in funds.items()])
+        db.session.commit()
+        start = datetime(1970, 1, 1)
+        rows = [{'userId': user, 'usageTimestamp': start + timedelta(seconds=int(second)), 'callsMinutes': call, 'smsCount': count}
+                for user, second, call, count in zip(user_ids.tolist(), timestamps.astype('int64').tolist(), calls.tolist(), sms.tolist())]
+        (accepted, _), seconds = timed(rate_usage, rows)
+        db.session.commit()
+        return accepted, seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the usage rating engine.")
+    parser.add_argument('--events', type=int, default=200000, help="usage events of the batch")
+    parser.add_argument('--users', type=int, default=2000, help="users of the batch")
+    args = parser.parse_args()
+
+    user_ids, timestamps, calls, sms, funds = synthetic_events(args.events, args.users)
+    costs = event_costs(calls, sms)
+    expected, loop_seconds = timed(sequential, user_ids, timestamps, costs, funds)
+    (accepted, _), numpy_seconds = timed(waterfall, user_ids, timestamps, costs, funds)
+    with tempfile.TemporaryDirectory() as directory:
+        rated, database_seconds = rate_database(os.path.join(directory, 'ratingBenchmark.db'), user_ids, timestamps, calls, sms, funds)
+
+    print(f"{args.events} events of {args.users} users, {np.count_nonzero(~expected)} rejected")
+    print(f"  {'event by event loop':28}{args.events / loop_seconds:14,.0f} events/s")
+    print(f"  {'numpy waterfall':28}{args.events / numpy_seconds:14,.0f} events/s")
+    print(f"  {'rate_usage on SQLite':28}{args.events / database_seconds:14,.0f} events/s")
+    mismatches = np.count_nonzero(accepted != expected) + np.count_nonzero(rated != expected)
+    print("same accepted events as the loop" if not mismatches else f"MISMATCH: {mismatches} events rated differently")
@@ -0,0 +1,90 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from configuration.regression import fit_lines, fit_lines_grouped, predict_lines
+
+# compares the closed-form usage regression with the previous sklearn LinearRegression path, on the simulated usage history
+# usage (from the TTWebApp folder): python -m benchmarks.regressionBenchmark [--repeat N] [--synthetic-users N]
+
+TARGETS = ['callsMinutes', 'smsCount', 'dataUsageMB']
+
+
+def load_usage(path):
+    data = pd.DataFrame(json.load(open(path)))
+    data['usageTimestamp'] = pd.to_datetime(data['usageTimestamp'])
+    data['days_since_first'] = (data['usageTimestamp'] - data.groupby('userId')['usageTimestamp'].transform('min')).dt.days
+    return data
+
+
+def synthetic_usage(users, days, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'userId': np.repeat(np.arange(users), days),
+        'days_since_first': np.tile(np.arange(days), users),
+        'callsMinutes': rng.poisson(15, users * days),
+        'smsCount': rng.poisson(5, users * days),
+        'dataUsageMB': rng.normal(500, 150, users * days),
+    })
+
+
+def sklearn_predictions(groups):
+    predictions = []
+    for user_data in groups:
+        X = user_data[['days_since_first']]
+        next_day = user_data['days_since_first'].max() + 1
+        predictions.append([LinearRegression().fit(X, user_data[target]).predict(pd.DataFrame({'days_since_first': [next_day]}))[0]
+                            for target in TARGETS])
+    return np.array(predictions)
+
+
+def numpy_predictions(groups):
+    predictions = []
+    for user_data in groups:
+        slopes, intercepts = fit_lines(user_data['days_since_first'].to_numpy(), user_data[TARGETS].to_numpy())
+        predictions.append(predict_lines(slopes, intercepts, user_data['days_since_first'].max() + 1))
+    return np.array(predictions)
+
+
+def grouped_predictions(data):
+    days = data['days_since_first'].to_numpy()
+    keys, slopes, intercepts = fit_lines_grouped(data['userId'].to_numpy(), days, data[TARGETS].to_numpy())
+    next_days = pd.Series(days).groupby(data['userId'].to_numpy()).max().reindex(keys).to_numpy() + 1
+    return predict_lines(slopes, intercepts, next_days[:, None])
+
+
+def timed(function, argument, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(title, data, repeat):
+    groups = [user_data for _, user_data in data.groupby('userId')]
+    sklearn_time, expected = timed(sklearn_predictions, groups, repeat)
+    numpy_time, per_user = timed(numpy_predictions, groups, repeat)
+    grouped_time, grouped = timed(grouped_predictions, data, repeat)
+
+    print(f"{title}: {len(groups)} users, {len(data)} rows")
+    print(f"  sklearn LinearRegression x3   {sklearn_time * 1000:10.2f} ms  ({sklearn_time / len(groups) * 1e6:9.1f} us/user)")
+    print(f"  fit_lines per user            {numpy_time * 1000:10.2f} ms  ({numpy_time / len(groups) * 1e6:9.1f} us/user)"
+          f"  max abs diff {np.abs(per_user - expected).max():.2e}")
+    print(f"  fit_lines_grouped all users   {grouped_time * 1000:10.2f} ms  ({grouped_time / len(groups) * 1e6:9.1f} us/user)"
+          f"  max abs diff {np.abs(grouped - expected).max():.2e}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the usage regression against sklearn.")
+    parser.add_argument('--usage', default='dataSimulation/usage_history.json', help="usage history json file")
+    parser.add_argument('--repeat', type=int, default=5, help="timing repetitions, the best one is reported")
+    parser.add_argument('--synthetic-users', type=int, default=1000, help="users of the synthetic history")
+    parser.add_argument('--synthetic-days', type=int, default=90, help="days of history per synthetic user")
+    args = parser.parse_args()
+
+    report("simulated history", load_usage(args.usage), args.repeat)
+    report("synthetic history", synthetic_usage(args.synthetic_users, args.synthetic_days), args.repeat)
@@ -0,0 +1,78 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from sqlalchemy import insert, select
+from configuration import create_application
+from configuration.dbInitialization import db
+from configuration.models import User, Question
+from configuration.questionSearch import search_questions
+
+# latency of the question search as the number of questions grows: the FTS5 ranked search of questionSearch.py against the
+# LIKE '%keyword%' scan it replaces, on synthetic questions of a Zipf distributed vocabulary (one page of 20 results per search)
+# usage (from the TTWebApp folder): python -m benchmarks.searchBenchmark [--sizes N N ...] [--repeat N]
+
+# a Zipf distributed vocabulary like real text: a few words are in most questions, most words are rare
+VOCABULARY_SIZE = 20000
+KEYWORD_RANKS = [10, 100, 1000, 10000]
+
+
+def vocabulary(seed=0):
+    rng = np.random.default_rng(seed)
+    letters = rng.integers(0, 26, (VOCABULARY_SIZE, 7))
+    words = np.unique([''.join(chr(97 + letter) for letter in word) for word in letters])
+    rng.shuffle(words)
+    weights = 1 / np.arange(1, len(words) + 1)
+    return words, weights / weights.sum()
+
+
+def add_questions(count, words, weights, seed):
+    rng = np.random.default_rng(seed)
+    for offset in range(0, count, 50000):
+        size = min(50000, count - offset)
+        lengths = rng.integers(6, 20, size)
+        db.session.execute(insert(Question), [
+            {'userId': 1, 'content': ' '.join(rng.choice(words, length, p=weights)) + '?'} for length in lengths
+        ])
+    db.session.commit()
+
+
+def median_ms(search, keywords, repeat):
+    timings = []
+    for _ in range(repeat):
+        for keyword in keywords:
+            start = time.perf_counter()
+            search(keyword)
+            timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000
+
+
+def like_search(keyword):
+    ids = db.session.execute(select(Question.id).where(Question.content.ilike(f'%{keyword}%'))
+                             .order_by(Question.id.desc()).limit(21)).scalars().all()
+    return Question.query.filter(Question.id.in_(ids)).all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the full-text question search against a LIKE scan.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 300000], help="numbers of questions")
+    parser.add_argument('--repeat', type=int, default=5, help="searches of each keyword")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_application({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'searchBenchmark.db')}"})
+        with app.app_context():
+            db.create_all()
+            db.session.execute(insert(User), [{'phoneNumber': '90000000', 'bonusPlan': 2}])
+            words, weights = vocabulary()
+            # a common, a frequent, a rare and a very rare word, and a two words search
+            keywords = [words[rank] for rank in KEYWORD_RANKS] + [f'{words[5]} {words[200]}']
+            print(f"  {'questions':>10}{'fts5 ranked':>14}{'like scan':>14}")
+            total = 0
+            for size in sorted(args.sizes):
+                add_questions(size - total, words, weights, seed=size)
+                total = size
+                fts = median_ms(lambda keyword: search_questions(keyword, 0, 20), keywords, args.repeat)
+                like = median_ms(like_search, keywords, args.repeat)
+                print(f"  {size:>10}{fts:11.2f} ms{like:11.2f} ms")
@@ -0,0 +1,98 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from configuration.groupStats import STATISTICS, group_statistics
+
+# checks that the vectorized daily statistics match the pandas groupby/lambda aggregation they replace, then times both
+# the timings are on a 1M row history grouped by day (few large groups) and by user and day (many small groups)
+# usage (from the TTWebApp folder): python -m benchmarks.statsBenchmark [--rows N] [--repeat N]
+
+USAGE_COLUMNS = {'calls': 'callsMinutes', 'sms': 'smsCount', 'data_usage': 'dataUsageMB'}
+RECHARGE_COLUMNS = {'recharge': 'rechargeAmount', 'data_recharge': 'dataAddedMB'}
+
+
+def pandas_statistics(data, columns):
+    # the aggregation of blueprint.predict before the statistics kernel
+    mode = lambda x: pd.Series.mode(x).iloc[0] if not x.mode().empty else np.nan
+    stats = data.groupby('date').agg({column: ['mean', 'std', 'median', mode] for column in columns.values()}).reset_index()
+    stats.columns = ['date'] + [f'{prefix}_{statistic}' for prefix in columns for statistic in STATISTICS]
+    return stats
+
+
+def kernel_statistics(data, columns):
+    keys, statistics = group_statistics(data['date'].to_numpy(), {prefix: data[column].to_numpy() for prefix, column in columns.items()})
+    return pd.DataFrame({'date': keys, **{f'{prefix}_{statistic}': statistics[prefix][statistic]
+                                          for prefix in columns for statistic in STATISTICS}})
+
+
+def check(title, data, columns):
+    expected = pandas_statistics(data, columns)
+    result = kernel_statistics(data, columns)
+    assert list(expected['date']) == list(result['date']), f"{title}: different dates"
+    worst = 0.0
+    for name in expected.columns[1:]:
+        a = expected[name].to_numpy(dtype=np.float64)
+        b = result[name].to_numpy(dtype=np.float64)
+        assert np.array_equal(np.isnan(a), np.isnan(b)), f"{title}: {name} is missing on different dates"
+        assert np.allclose(a, b, rtol=1e-9, atol=1e-9, equal_nan=True), f"{title}: {name} differs"
+        if np.isfinite(a).any():
+            worst = max(worst, np.nanmax(np.abs(a - b)))
+    print(f"{title}: {len(expected)} dates, {len(data)} rows, same statistics (max abs diff {worst:.2e})")
+
+
+def load(path, date_column, columns):
+    data = pd.DataFrame(json.load(open(path)))
+    data['date'] = pd.to_datetime(data[date_column]).dt.date
+    return data[['date'] + list(columns.values())]
+
+
+def synthetic_history(rows, days, seed=0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'date': rng.integers(0, days, rows),
+        'callsMinutes': rng.poisson(15, rows),
+        'smsCount': rng.poisson(5, rows),
+        'dataUsageMB': np.round(rng.normal(500, 150, rows), 1),
+        'rechargeAmount': np.round(rng.uniform(0, 50, rows)),
+        'dataAddedMB': rng.choice([0.0, 500.0, 1024.0, 2048.0], rows),
+    })
+    # recharges without amount, and one day where it is always missing
+    data.loc[rng.random(rows) < 0.05, 'rechargeAmount'] = np.nan
+    data.loc[data['date'] == 0, 'rechargeAmount'] = np.nan
+    return data
+
+
+def timed(function, data, columns, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(data, columns)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check and benchmark the vectorized daily statistics.")
+    parser.add_argument('--usage', default='dataSimulation/usage_history.json', help="usage history json file")
+    parser.add_argument('--recharges', default='dataSimulation/recharge_history.json', help="recharge history json file")
+    parser.add_argument('--rows', type=int, default=1000000, help="rows of the synthetic history")
+    parser.add_argument('--days', type=int, default=365, help="days of the synthetic history")
+    parser.add_argument('--user-days', type=int, default=20000, help="user days of the synthetic history grouped by user and day")
+    parser.add_argument('--repeat', type=int, default=3, help="timing repetitions, the best one is reported")
+    args = parser.parse_args()
+
+    columns = {**USAGE_COLUMNS, **RECHARGE_COLUMNS}
+    check("simulated usage history", load(args.usage, 'usageTimestamp', USAGE_COLUMNS), USAGE_COLUMNS)
+    check("simulated recharge history", load(args.recharges, 'rechargeDate', RECHARGE_COLUMNS), RECHARGE_COLUMNS)
+    check("synthetic history (small)", synthetic_history(5000, 30, seed=1), columns)
+    for groups in [args.days, args.user_days]:
+        data = synthetic_history(args.rows, groups)
+        check(f"synthetic history, {groups} groups", data, columns)
+
+        pandas_time = timed(pandas_statistics, data, columns, args.repeat)
+        kernel_time = timed(kernel_statistics, data, columns, args.repeat)
+        print(f"{args.rows} rows, {groups} groups, {len(columns)} columns")
+        print(f"  pandas groupby with lambda mode  {pandas_time * 1000:10.1f} ms")
+        print(f"  group_statistics                 {kernel_time * 1000:10.1f} ms  ({pandas_time / kernel_time:.1f}x)")
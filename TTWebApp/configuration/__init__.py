@@ -1,22 +1,40 @@
 from flask import Flask
 from flask_login import LoginManager
-from .dbInitialization import db
+from .dbInitialization import db, engine_options, configure_engines
+from .settings import Config
 from .blueprint import blp
 from .apiRoutes import apiblp
-from .models import User
+from .identityCache import identity_cache
+from .modelCache import model_cache
+from .predictionJobs import prediction_jobs
+from .migrations import register_commands
+from .queryBudget import install_query_budget
 
-DB_NAME = "appDatabase.db"
 
-
-def create_application():
+def create_application(config=None):
     app = Flask(__name__)
-    app.config['SECRET_KEY'] = 'TTapp'
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_NAME}'
-    
+    app.config.from_object(Config)
+    app.config.from_prefixed_env('TTAPP')
+    # overrides, e.g. another database for the benchmarks, as a dict or a settings object
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
     db.init_app(app)
+    with app.app_context():
+        configure_engines(app.config)
+        if app.config['TESTING'] or app.config['QUERY_BUDGET_CHECKS']:
+            install_query_budget(app)
+    model_cache.configure(app.config['MODEL_CACHE_MAX_ENTRIES'], app.config['MODEL_CACHE_MAX_BYTES'])
+    identity_cache.configure(app.config['IDENTITY_CACHE_MAX_ENTRIES'], app.config['IDENTITY_CACHE_TTL_SECONDS'])
+    prediction_jobs.configure(app.config['PREDICT_WORKERS'], app.config['PREDICT_MAX_PENDING'],
+                              app.config['PREDICT_MAX_PENDING_PER_USER'], app.config['PREDICT_JOB_KEEP_SECONDS'])
 
     app.register_blueprint(blp, url_prefix='/')
     app.register_blueprint(apiblp)
+    register_commands(app)
 
     login_manager = LoginManager()
     login_manager.login_view = 'blp.login'
@@ -24,6 +42,7 @@ def create_application():
 
     @login_manager.user_loader
     def load_user(id):
-        return User.query.get(int(id))
+        # snapshot of the user and its balance, one joined query on a cache miss
+        return identity_cache.get(int(id))
 
     return app
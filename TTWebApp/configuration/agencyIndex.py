@@ -0,0 +1,112 @@
+from collections import namedtuple
+from threading import Lock
+import numpy as np
+from sqlalchemy import func
+from .models import db, AgencyLocation
+
+# in-process spatial index of the agency locations used by the /find page------------------------------------------------------------
+# agencies are stored as points on the unit sphere in a KD-tree, the chord distance between two points grows with their
+# great-circle distance so the tree finds the nearest candidates, which are then refined with the exact geodesic distance
+# scikit-learn and geopy are imported when the index is first used, not with the web application
+
+EARTH_RADIUS_KM = 6371.0088
+
+# lightweight copy of an AgencyLocation row, safe to share between requests
+Agency = namedtuple('Agency', ['id', 'name', 'address', 'phoneNumber', 'latitude', 'longitude'])
+
+
+def unit_vectors(latitudes, longitudes):
+    """Convert latitudes and longitudes in degrees to points on the unit sphere."""
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lng = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.column_stack((np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)))
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Great-circle distance in km from one point (in degrees) to arrays of points (in radians, as stored by the index)."""
+    lat = np.radians(latitude)
+    lng = np.radians(longitude)
+    a = np.sin((latitudes - lat) / 2) ** 2 + np.cos(lat) * np.cos(latitudes) * np.sin((longitudes - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class _Snapshot:
+    def __init__(self, version, agencies):
+        from sklearn.neighbors import KDTree
+        self.version = version
+        self.agencies = agencies
+        self.latitudes = np.radians([a.latitude for a in agencies])
+        self.longitudes = np.radians([a.longitude for a in agencies])
+        self.tree = KDTree(unit_vectors([a.latitude for a in agencies], [a.longitude for a in agencies])) if agencies else None
+
+
+class AgencyIndex:
+    def __init__(self, refine=5):
+        self.refine = refine  # candidates refined with the exact geodesic distance
+        self._snapshot = None
+        self._lock = Lock()
+
+    def invalidate(self):
+        """Force a rebuild on next use, called when the agency locations are modified."""
+        with self._lock:
+            self._snapshot = None
+
+    def snapshot(self):
+        """Return the current snapshot, rebuilding it when the agency table changed since it was built."""
+        version = tuple(db.session.query(func.count(AgencyLocation.id), func.max(AgencyLocation.id)).one())
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                agencies = [Agency(*row) for row in db.session.query(AgencyLocation.id, AgencyLocation.name, AgencyLocation.address,
+                                                                     AgencyLocation.phoneNumber, AgencyLocation.latitude,
+                                                                     AgencyLocation.longitude).order_by(AgencyLocation.id)]
+                self._snapshot = _Snapshot(version, agencies)
+            return self._snapshot
+
+    def all(self):
+        """Return every agency."""
+        return self.snapshot().agencies
+
+    def closest(self, latitude, longitude):
+        """Return the closest agency and its geodesic distance in meters, or (None, None) without agencies."""
+        snapshot = self.snapshot()
+        if not snapshot.agencies:
+            return None, None
+
+        k = min(self.refine, len(snapshot.agencies))
+        candidates = snapshot.tree.query(unit_vectors([latitude], [longitude]), k=k, return_distance=False)[0]
+
+        from geopy.distance import geodesic
+        # ties keep the agency with the smallest id, like the previous linear scan
+        distance, position = min((geodesic((latitude, longitude), (snapshot.agencies[i].latitude, snapshot.agencies[i].longitude)).meters, i)
+                                 for i in candidates)
+        return snapshot.agencies[position], distance
+
+    def nearest(self, latitude, longitude, k):
+        """Return the k nearest agencies as (agency, distance in km) pairs, closest first."""
+        snapshot = self.snapshot()
+        k = min(k, len(snapshot.agencies))
+        if k <= 0:
+            return []
+
+        candidates = snapshot.tree.query(unit_vectors([latitude], [longitude]), k=k, return_distance=False)[0]
+        return self._sorted(snapshot, latitude, longitude, candidates)
+
+    def within(self, latitude, longitude, radius_km):
+        """Return the agencies at most radius_km away as (agency, distance in km) pairs, closest first."""
+        snapshot = self.snapshot()
+        if not snapshot.agencies:
+            return []
+
+        # chord length on the unit sphere matching the great-circle radius
+        chord = 2 * np.sin(min(radius_km / EARTH_RADIUS_KM, np.pi) / 2)
+        candidates = snapshot.tree.query_radius(unit_vectors([latitude], [longitude]), r=chord)[0]
+        return [(agency, distance) for agency, distance in self._sorted(snapshot, latitude, longitude, candidates)
+                if distance <= radius_km]
+
+    def _sorted(self, snapshot, latitude, longitude, candidates):
+        distances = haversine_km(latitude, longitude, snapshot.latitudes[candidates], snapshot.longitudes[candidates])
+        order = np.lexsort((candidates, distances))
+        return [(snapshot.agencies[candidates[i]], float(distances[i])) for i in order]
+
+
+agency_index = AgencyIndex()
@@ -1,8 +1,23 @@
 from flask.views import MethodView
 from flask_smorest import Blueprint
-from flask import request, jsonify
-from .models import db, User, UsageHistory, Balance, Recharge, MonetaryRechargePlan, MobileDataPlan, AgencyLocation, Question, Answer
-from datetime import datetime
+from flask import request, jsonify, Response, stream_with_context, current_app
+from .dbInitialization import UPSERT_DIALECTS
+from .models import db, User, UsageHistory, DailyUsageRollup, Balance, Recharge, MonetaryRechargePlan, MobileDataPlan, AgencyLocation, Question, Answer
+from .modelCache import model_cache
+from .agencyIndex import agency_index
+from .planCatalog import plan_catalog
+from .identityCache import identity_cache
+from .questionSearch import search_questions
+from .balanceAdjustments import ADJUSTMENT_FIELDS, adjust_balances
+from .usageRating import RatingConflict, rate_usage
+from .rollups import add_usage, refresh_day
+from .historyStore import usage_columns, recharge_columns, to_records
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+from collections import Counter
+from datetime import date, datetime, timedelta
+import json
+import math
 
 apiblp = Blueprint('users', __name__, description="Operations on Users")
 
@@ -11,53 +26,235 @@ def convert_date(date_str):
     return datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else None
 
 
+# Keyset pagination of the collection endpoints----------------------------------------------------------------------------------
+# pages are requested with ?after_id=<next_cursor of the previous page>&limit=<page size>, the last page has next_cursor null
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+# read an optional integer query parameter, returns None when it is not an integer
+def int_argument(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+# read the after_id and limit query parameters, returns None when they are invalid
+def page_arguments():
+    after_id = int_argument("after_id", 0)
+    limit = int_argument("limit", DEFAULT_PAGE_SIZE)
+    if after_id is None or limit is None or limit < 1:
+        return None
+    return after_id, min(limit, MAX_PAGE_SIZE)
+
+
+# rows with an id greater than after_id in id order, along with the cursor of the next page
+def paginate(query, model, after_id, limit):
+    rows = query.filter(model.id > after_id).order_by(model.id).limit(limit + 1).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# apply the optional userId, from and to (YYYY-MM-DD, both inclusive) filters of the history endpoints
+# returns None when a parameter is invalid
+def filter_history(query, model, date_column):
+    user_id = int_argument("userId")
+    if "userId" in request.args:
+        if user_id is None:
+            return None
+        query = query.filter(model.userId == user_id)
+
+    try:
+        date_from = convert_date(request.args.get("from"))
+        date_to = convert_date(request.args.get("to"))
+    except ValueError:
+        return None
+
+    # usage timestamps are datetimes, so they are compared with midnight and the day after "to" is excluded
+    if date_column.type.python_type is datetime:
+        date_from = datetime.combine(date_from, datetime.min.time()) if date_from else None
+        date_to = datetime.combine(date_to, datetime.min.time()) + timedelta(days=1) if date_to else None
+        if date_to:
+            query = query.filter(date_column < date_to)
+    elif date_to:
+        query = query.filter(date_column <= date_to)
+    if date_from:
+        query = query.filter(date_column >= date_from)
+    return query
+
+
+PAGE_ERROR = "after_id must be an integer and limit a positive integer."
+HISTORY_FILTER_ERROR = "userId must be an integer, from and to dates in YYYY-MM-DD format."
+
+
+# Streaming export of the history endpoints------------------------------------------------------------------------------------
+# with ?stream=1 or an "Accept: application/x-ndjson" header the whole (filtered) table is sent as one JSON record per line,
+# rows are read in batches of EXPORT_BATCH_SIZE without building ORM objects so memory does not grow with the table size
+EXPORT_BATCH_SIZE = 1000
+
+
+def wants_stream():
+    return request.args.get("stream") == "1" or \
+        request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson"
+
+
+def ndjson_response(query, columns, after_id=0):
+    def generate():
+        rows = query.with_entities(*columns).filter(columns[0] > after_id).order_by(columns[0]).yield_per(EXPORT_BATCH_SIZE)
+        for row in rows:
+            yield json.dumps({column.key: value.isoformat() if isinstance(value, date) else value
+                              for column, value in zip(columns, row)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# Bulk ingestion of the history endpoints---------------------------------------------------------------------------------------
+# with ?bulk=1 the validated rows are inserted in chunks of ?chunk_size= rows (BULK_CHUNK_SIZE by default), one transaction
+# per chunk, and the response only carries the counts and the indexes of the rejected records
+# the validation is pandas based, bulkIngest.py is only imported by the first bulk request (see benchmarks/importBenchmark.py),
+# the callers pass its validate_* function of the model
+def bulk_insert_response(model, validator, data, on_chunk=None):
+    from . import bulkIngest
+
+    chunk_size = int_argument("chunk_size", current_app.config['BULK_CHUNK_SIZE'])
+    if chunk_size is None or chunk_size < 1:
+        return jsonify({"error": "chunk_size must be a positive integer."}), 400
+
+    rows, rejected = validator(data)
+    inserted = bulkIngest.insert_chunks(model, rows, chunk_size, on_chunk)
+    for user_id in {row["userId"] for row in rows}:
+        model_cache.invalidate(user_id)
+        identity_cache.invalidate(user_id)
+
+    return jsonify({"message": f"Inserted {inserted} records.", "inserted": inserted, "rejected": rejected}), 201
+
+
+# Set-based duplicate checks and upserts of the users and balances endpoints------------------------------------------------------
+# instead of one query per record, existing keys are looked up with one IN (...) query per chunk of DUPLICATE_CHECK_CHUNK keys
+# ?on_conflict=skip keeps the existing rows and ?on_conflict=update overwrites them, both through ON CONFLICT (SQLite or PostgreSQL)
+DUPLICATE_CHECK_CHUNK = 500
+ON_CONFLICT_ERROR = "on_conflict must be update or skip."
+
+
+def existing_keys(column, keys):
+    found = set()
+    keys = list(keys)
+    for start in range(0, len(keys), DUPLICATE_CHECK_CHUNK):
+        found.update(value for value, in db.session.query(column).filter(column.in_(keys[start:start + DUPLICATE_CHECK_CHUNK])))
+    return found
+
+
+def repeated_keys(keys):
+    return [key for key, count in Counter(keys).items() if count > 1]
+
+
+# the ON CONFLICT clauses are built by the dialect of the configured database (see UPSERT_DIALECTS)
+def insert_statement(model, key, on_conflict, update_columns):
+    statement = UPSERT_DIALECTS[db.engine.dialect.name](model.__table__)
+    if on_conflict == "skip":
+        return statement.on_conflict_do_nothing(index_elements=[key])
+    if on_conflict == "update":
+        return statement.on_conflict_do_update(index_elements=[key], set_=update_columns(statement.excluded))
+    return statement
+
+
 # endpoints for Users simulated data------------------------------------------------------------------------------------------
 @apiblp.route('/api/users')
 class Users(MethodView):
     def get(self):
-        """Get all users."""
-        users = User.query.all()
-        return [
-            {
-                "id": user.id,
-                "phoneNumber": user.phoneNumber,
-                "username": user.username,
-                "bonusPlan": user.bonusPlan
-            }
-            for user in users
-        ], 200
+        """Get users one page at a time."""
+        page = page_arguments()
+        if page is None:
+            return jsonify({"error": PAGE_ERROR}), 400
+
+        users, next_cursor = paginate(User.query, User, *page)
+        return {
+            "items": [
+                {
+                    "id": user.id,
+                    "phoneNumber": user.phoneNumber,
+                    "username": user.username,
+                    "bonusPlan": user.bonusPlan
+                }
+                for user in users
+            ],
+            "next_cursor": next_cursor,
+        }, 200
 
     def post(self):
-     """Add one or more users with provided JSON data."""
+     """Add one or more users with provided JSON data, ?on_conflict=update|skip makes the import idempotent."""
      data = request.get_json()
+     on_conflict = request.args.get("on_conflict")
+     if on_conflict not in (None, "update", "skip"):
+        return jsonify({"error": ON_CONFLICT_ERROR}), 400
 
      if not isinstance(data, list):
         data = [data]  # Wrap single object in a list
 
-     created_users = []
      for user_data in data:
-        if not user_data or "phoneNumber" not in user_data or "bonusPlan" not in user_data:
+        if not isinstance(user_data, dict) or "phoneNumber" not in user_data or "bonusPlan" not in user_data:
             return jsonify({"error": "Each user must have phoneNumber and bonusPlan fields."}), 400
-
-        if User.query.filter_by(phoneNumber=user_data["phoneNumber"]).first():
-            return jsonify({"error": f"User with phone number {user_data['phoneNumber']} already exists."}), 400
-
-        user = User(
-            phoneNumber=user_data["phoneNumber"],
-            username=user_data.get("username"),
-            passwordHash=None,
-            bonusPlan=user_data["bonusPlan"]
-        )
-        db.session.add(user)
-        created_users.append({"bonsPlan": user.bonusPlan, "phoneNumber": user.phoneNumber})
-
-     db.session.commit()
-     return jsonify({"message": "Users added successfully.", "users": created_users}), 201
+        phone_number, bonus_plan, username = user_data["phoneNumber"], user_data["bonusPlan"], user_data.get("username")
+        if isinstance(phone_number, bool) or not isinstance(phone_number, (str, int)) or not str(phone_number):
+            return jsonify({"error": "phoneNumber must be a string."}), 400
+        if isinstance(bonus_plan, bool) or not isinstance(bonus_plan, int):
+            return jsonify({"error": "bonusPlan must be an integer."}), 400
+        if username is not None and not isinstance(username, str):
+            return jsonify({"error": "username must be a string."}), 400
+
+     # a key may only appear once per statement, whatever on_conflict is (PostgreSQL refuses to upsert a row twice)
+     phone_numbers = [str(user_data["phoneNumber"]) for user_data in data]
+     repeated = repeated_keys(phone_numbers)
+     if repeated:
+        return jsonify({"error": f"User with phone number {repeated[0]} appears more than once."}), 400
+     existing = existing_keys(User.phoneNumber, phone_numbers)
+     if existing and on_conflict is None:
+        return jsonify({"error": f"User with phone number {sorted(existing)[0]} already exists."}), 409
+
+     rows = [
+        {
+            "phoneNumber": str(user_data["phoneNumber"]),
+            "username": user_data.get("username"),
+            "passwordHash": None,
+            "bonusPlan": user_data["bonusPlan"]
+        }
+        for user_data in data
+     ]
+     # an update keeps the username (and password) of users that already signed up
+     statement = insert_statement(User, "phoneNumber", on_conflict, lambda excluded: {
+        "bonusPlan": excluded.bonusPlan,
+        "username": func.coalesce(excluded.username, User.__table__.c.username),
+     })
+     try:
+        if rows:
+            db.session.execute(statement, rows)
+        db.session.commit()
+     except IntegrityError:
+        # a username taken by another user, or a user added meanwhile by another request
+        db.session.rollback()
+        return jsonify({"error": "A user conflicts with an existing user (phone number or username)."}), 409
+     # an update may change cached users, their ids are not returned by the upsert
+     identity_cache.invalidate()
+
+     created_users = [{"bonsPlan": row["bonusPlan"], "phoneNumber": row["phoneNumber"]} for row in rows if row["phoneNumber"] not in existing]
+     return jsonify({
+        "message": f"Added {len(created_users)} users.",
+        "inserted": len(created_users),
+        "updated": len(existing) if on_conflict == "update" else 0,
+        "skipped": len(existing) if on_conflict == "skip" else 0,
+        "users": created_users,
+     }), 201
 
     def delete(self):
         """Delete all users."""
         num_deleted = db.session.query(User).delete()
         db.session.commit()
+        model_cache.invalidate()
+        identity_cache.invalidate()
         return jsonify({"message": f"Deleted {num_deleted} users."}), 200
 
 
@@ -84,34 +281,68 @@ class SingleUser(MethodView):
 
         db.session.delete(user)
         db.session.commit()
+        model_cache.invalidate(user_id)
+        identity_cache.invalidate(user_id)
         return jsonify({"message": f"User with ID {user_id} deleted."}), 200
 
 
 # endpoints for Users history simulated data------------------------------------------------------------------------------------------
+# the counters of a usage record, checked like bulkIngest.validate_usage before they are added to the daily rollups
+def usage_counter_error(entry):
+    for field in ["callsMinutes", "smsCount", "dataUsageMB"]:
+        if field not in entry:
+            continue
+        value = entry[field]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+            return f"{field} must be a non-negative number."
+        if field != "dataUsageMB" and value != int(value):
+            return f"{field} must be a whole number."
+    return None
+
+
 @apiblp.route('/api/usageHistory')
 class UsageHistoryAPI(MethodView):
     def get(self):
-        """Get all usage history records."""
-        usage_history = UsageHistory.query.all()
-        return [
-            {
-                "id": entry.id,
-                "userId": entry.userId,
-                "usageTimestamp": entry.usageTimestamp,
-                "callsMinutes": entry.callsMinutes,
-                "smsCount": entry.smsCount,
-                "dataUsageMB": entry.dataUsageMB
-            }
-            for entry in usage_history
-        ], 200
+        """Get usage history records one page at a time, or all of them as NDJSON, optionally filtered by userId and from/to dates."""
+        page = page_arguments()
+        if page is None:
+            return jsonify({"error": PAGE_ERROR}), 400
+
+        query = filter_history(UsageHistory.query, UsageHistory, UsageHistory.usageTimestamp)
+        if query is None:
+            return jsonify({"error": HISTORY_FILTER_ERROR}), 400
+
+        if wants_stream():
+            return ndjson_response(query, [UsageHistory.id, UsageHistory.userId, UsageHistory.usageTimestamp,
+                                           UsageHistory.callsMinutes, UsageHistory.smsCount, UsageHistory.dataUsageMB], page[0])
+
+        usage_history, next_cursor = paginate(query, UsageHistory, *page)
+        return {
+            "items": [
+                {
+                    "id": entry.id,
+                    "userId": entry.userId,
+                    "usageTimestamp": entry.usageTimestamp,
+                    "callsMinutes": entry.callsMinutes,
+                    "smsCount": entry.smsCount,
+                    "dataUsageMB": entry.dataUsageMB
+                }
+                for entry in usage_history
+            ],
+            "next_cursor": next_cursor,
+        }, 200
 
     def post(self):
-        """Add one or more usage history records."""
+        """Add one or more usage history records, ?bulk=1 inserts them in chunks and only returns counts."""
         data = request.get_json()
 
         if not isinstance(data, list):
             data = [data] 
 
+        if request.args.get("bulk") == "1":
+            from . import bulkIngest
+            return bulk_insert_response(UsageHistory, bulkIngest.validate_usage, data, on_chunk=add_usage)
+
         created_entries = []
         for entry_data in data:
             if not entry_data or "userId" not in entry_data:
@@ -124,6 +355,9 @@ class UsageHistoryAPI(MethodView):
                 return jsonify(
                     {"error": "At least one field (callsMinutes, smsCount, or dataUsageMB) must be provided."}
                 ), 400
+            error = usage_counter_error(entry_data)
+            if error:
+                return jsonify({"error": error}), 400
             
             try:
                 entry_data["usageTimestamp"] = datetime.fromisoformat(entry_data["usageTimestamp"])
@@ -148,16 +382,61 @@ class UsageHistoryAPI(MethodView):
                 }
             )
 
+        add_usage(created_entries)
         db.session.commit()
+        for user_id in {entry["userId"] for entry in created_entries}:
+            model_cache.invalidate(user_id)
+            identity_cache.invalidate(user_id)
         return jsonify({"message": "Usage history added successfully.", "usage": created_entries}), 201
 
     def delete(self):
         """Delete all usage history records."""
         num_deleted = db.session.query(UsageHistory).delete()
+        db.session.query(DailyUsageRollup).delete()
         db.session.commit()
+        model_cache.invalidate()
+        identity_cache.invalidate()
         return jsonify({"message": f"Deleted {num_deleted} usage history records."}), 200
 
 
+@apiblp.route('/api/usageHistory/rate')
+class RateUsage(MethodView):
+    def post(self):
+        """Charge a batch of usage events to the balances (bonus first, then monetary) and record the accepted ones in the usage history."""
+        from . import bulkIngest
+
+        data = request.get_json()
+        if not isinstance(data, list):
+            data = [data]
+
+        # negative and fractional counters are invalid, so no event has a negative cost
+        rows, invalid = bulkIngest.validate_usage(data)
+        invalid_indexes = set(invalid)
+        indexes = [index for index in range(len(data)) if index not in invalid_indexes]
+        try:
+            accepted, spending = rate_usage(rows)
+        except RatingConflict as error:
+            db.session.rollback()
+            return jsonify({"error": str(error)}), 409
+
+        rated = [row for row, keep in zip(rows, accepted) if keep]
+        if rated:
+            db.session.execute(insert(UsageHistory.__table__), rated)
+            add_usage(rated)
+        db.session.commit()
+        for user_id in {row["userId"] for row in rows}:
+            model_cache.invalidate(user_id)
+            identity_cache.invalidate(user_id)
+
+        return jsonify({
+            "message": f"Rated {len(rated)} usage events.",
+            "rated": len(rated),
+            "charged": sum(bonus + monetary for bonus, monetary in spending.values()),
+            "rejected": [index for index, keep in zip(indexes, accepted) if not keep],
+            "invalid": invalid,
+        }), 201
+
+
 @apiblp.route('/api/usageHistory/<int:usage_id>')
 class SingleUsageHistory(MethodView):
     def get(self, usage_id):
@@ -182,27 +461,24 @@ class SingleUsageHistory(MethodView):
             return jsonify({"error": "Usage history not found."}), 404
 
         db.session.delete(entry)
+        db.session.flush()
+        refresh_day(entry.userId, entry.usageTimestamp.date())
         db.session.commit()
+        model_cache.invalidate(entry.userId)
+        identity_cache.invalidate(entry.userId)
         return jsonify({"message": f"Usage history with ID {usage_id} deleted."}), 200
 
 
 @apiblp.route('/api/usageHistory/user/<int:user_id>', methods=['GET'])
 def usageHistoryByUser(user_id):
     """Get usage history for a specific user."""
-    usage_records = UsageHistory.query.filter_by(userId=user_id).all()
-    if not usage_records:
+    usage = usage_columns(user_id, ["userId", "usageTimestamp", "callsMinutes", "smsCount", "dataUsageMB"])
+    if not len(usage["userId"]):
         return jsonify({"message": "No usage history found for this user."}), 404
     
-    result = [
-        {
-            "userId": record.userId,
-            "usageTimestamp": record.usageTimestamp.isoformat(),
-            "callsMinutes": record.callsMinutes,
-            "smsCount": record.smsCount,
-            "dataUsageMB": record.dataUsageMB
-        }
-        for record in usage_records
-    ]
+    result = to_records(usage)
+    for record in result:
+        record["usageTimestamp"] = record["usageTimestamp"].isoformat()
     return jsonify(result), 200
 
 
@@ -210,38 +486,46 @@ def usageHistoryByUser(user_id):
 @apiblp.route('/api/balances')
 class Balances(MethodView):
     def get(self):
-        """Get all balances."""
-        balances = Balance.query.all()
-        return [
-            {
-                "id": balance.id,
-                "userId": balance.userId,
-                "monetaryBalance": balance.monetaryBalance,
-                "bonusBalance": balance.bonusBalance,
-                "dataBalanceMB": balance.dataBalanceMB,
-                "monetaryExpiryDate": balance.monetaryExpiryDate.isoformat() if balance.monetaryExpiryDate else None,
-                "bonusExpiryDate": balance.bonusExpiryDate.isoformat() if balance.bonusExpiryDate else None,
-                "dataExpiryDate": balance.dataExpiryDate.isoformat() if balance.dataExpiryDate else None,
-            }
-            for balance in balances
-        ], 200
+        """Get balances one page at a time."""
+        page = page_arguments()
+        if page is None:
+            return jsonify({"error": PAGE_ERROR}), 400
+
+        balances, next_cursor = paginate(Balance.query, Balance, *page)
+        return {
+            "items": [
+                {
+                    "id": balance.id,
+                    "userId": balance.userId,
+                    "monetaryBalance": balance.monetaryBalance,
+                    "bonusBalance": balance.bonusBalance,
+                    "dataBalanceMB": balance.dataBalanceMB,
+                    "monetaryExpiryDate": balance.monetaryExpiryDate.isoformat() if balance.monetaryExpiryDate else None,
+                    "bonusExpiryDate": balance.bonusExpiryDate.isoformat() if balance.bonusExpiryDate else None,
+                    "dataExpiryDate": balance.dataExpiryDate.isoformat() if balance.dataExpiryDate else None,
+                }
+                for balance in balances
+            ],
+            "next_cursor": next_cursor,
+        }, 200
 
     
     def post(self):
-        """Add one or more balances."""
+        """Add one or more balances, ?on_conflict=update|skip makes the import idempotent."""
         data = request.get_json()
+        on_conflict = request.args.get("on_conflict")
+        if on_conflict not in (None, "update", "skip"):
+            return jsonify({"error": ON_CONFLICT_ERROR}), 400
 
         if not isinstance(data, list):
             data = [data]  
 
+        rows = []
         created_balances = []
         for balance_data in data:
             if "userId" not in balance_data:
                 return jsonify({"error": "Each balance must have a userId field."}), 400
 
-            if Balance.query.filter_by(userId=balance_data["userId"]).first():
-                return jsonify({"error": f"Balance for user ID {balance_data['userId']} already exists."}), 400
-
             monetaryBalance = balance_data.get("monetaryBalance", 0)
             bonusBalance = balance_data.get("bonusBalance", 0)
             dataBalanceMB = balance_data.get("dataBalanceMB", 0)
@@ -257,30 +541,56 @@ class Balances(MethodView):
             if dataExpiryDate:
                 dataExpiryDate = convert_date(dataExpiryDate)
 
-            balance = Balance(
-                userId=balance_data["userId"],
-                monetaryBalance=monetaryBalance,
-                bonusBalance=bonusBalance,
-                dataBalanceMB=dataBalanceMB,
-                monetaryExpiryDate=monetaryExpiryDate,
-                bonusExpiryDate=bonusExpiryDate,
-                dataExpiryDate=dataExpiryDate,
-            )
-            db.session.add(balance)
+            rows.append({
+                "userId": balance_data["userId"],
+                "monetaryBalance": monetaryBalance,
+                "bonusBalance": bonusBalance,
+                "dataBalanceMB": dataBalanceMB,
+                "monetaryExpiryDate": monetaryExpiryDate,
+                "bonusExpiryDate": bonusExpiryDate,
+                "dataExpiryDate": dataExpiryDate,
+            })
             created_balances.append({
-                "userId": balance.userId,
-                "monetaryBalance": balance.monetaryBalance,
-                "bonusBalance": balance.bonusBalance,
-                "dataBalanceMB": balance.dataBalanceMB,
+                "userId": balance_data["userId"],
+                "monetaryBalance": monetaryBalance,
+                "bonusBalance": bonusBalance,
+                "dataBalanceMB": dataBalanceMB,
             })
 
+        # a key may only appear once per statement, whatever on_conflict is (PostgreSQL refuses to upsert a row twice)
+        user_ids = [row["userId"] for row in rows]
+        repeated = repeated_keys(user_ids)
+        if repeated:
+            return jsonify({"error": f"Balance for user ID {repeated[0]} appears more than once."}), 400
+        existing = existing_keys(Balance.userId, user_ids)
+        if existing and on_conflict is None:
+            return jsonify({"error": f"Balance for user ID {sorted(existing)[0]} already exists."}), 409
+
+        statement = insert_statement(Balance, "userId", on_conflict, lambda excluded: {
+            column: excluded[column]
+            for column in ["monetaryBalance", "bonusBalance", "dataBalanceMB", "monetaryExpiryDate", "bonusExpiryDate", "dataExpiryDate"]
+        })
+        if rows:
+            db.session.execute(statement, rows)
         db.session.commit()
-        return jsonify({"message": "Balances added successfully.", "balances": created_balances}), 201
+        for user_id in set(user_ids):
+            identity_cache.invalidate(user_id)
+
+        # the balances written, the skipped ones are left as they are
+        written = [balance for balance in created_balances if on_conflict != "skip" or balance["userId"] not in existing]
+        return jsonify({
+            "message": "Balances added successfully.",
+            "inserted": len(rows) - len(existing),
+            "updated": len(existing) if on_conflict == "update" else 0,
+            "skipped": len(existing) if on_conflict == "skip" else 0,
+            "balances": written,
+        }), 201
 
     def delete(self):
         """Delete all balances."""
         num_deleted = db.session.query(Balance).delete()
         db.session.commit()
+        identity_cache.invalidate()
         return jsonify({"message": f"Deleted {num_deleted} balances."}), 200
 
 
@@ -311,6 +621,7 @@ class SingleBalance(MethodView):
 
         db.session.delete(balance)
         db.session.commit()
+        identity_cache.invalidate(balance.userId)
         return jsonify({"message": f"Balance with ID {balance_id} deleted."}), 200
 
 
@@ -361,6 +672,7 @@ class BalanceByUserId(MethodView):
             balance.dataExpiryDate = data["dataExpiryDate"]
 
         db.session.commit()
+        identity_cache.invalidate(user_id)
 
         return jsonify({
             "userId": balance.userId,
@@ -373,34 +685,126 @@ class BalanceByUserId(MethodView):
         }), 200
 
 
+# atomic adjustments of the balances: signed deltas and a charge spent bonus first, computed by the database (see balanceAdjustments.py)
+# a refused adjustment (a balance would go negative) changes nothing and answers 409, a batch applies the others and lists it
+def adjustment_error(adjustment):
+    if not isinstance(adjustment, dict):
+        return "Each adjustment must be a JSON object."
+    for field in ADJUSTMENT_FIELDS:
+        value = adjustment.get(field, 0)
+        # the JSON parser also reads Infinity and NaN
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            return f"{field} must be a finite number."
+    if adjustment.get("charge", 0) < 0:
+        return "charge must not be negative."
+    return None
+
+
+def adjusted_balance(row):
+    return {
+        "userId": row.userId,
+        "monetaryBalance": row.monetaryBalance,
+        "bonusBalance": row.bonusBalance,
+        "dataBalanceMB": row.dataBalanceMB,
+        "monetaryExpiryDate": row.monetaryExpiryDate.isoformat() if row.monetaryExpiryDate else None,
+        "bonusExpiryDate": row.bonusExpiryDate.isoformat() if row.bonusExpiryDate else None,
+        "dataExpiryDate": row.dataExpiryDate.isoformat() if row.dataExpiryDate else None,
+    }
+
+
+@apiblp.route('/api/balances/user/<int:user_id>/adjust')
+class AdjustBalance(MethodView):
+    def post(self, user_id):
+        """Add the monetary, bonus and dataMB deltas to the balance of a user and spend charge from its bonus then monetary balance."""
+        data = request.get_json()
+        error = adjustment_error(data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        row, = adjust_balances([{**data, "userId": user_id}])
+        if row is None:
+            db.session.rollback()
+            if not existing_keys(Balance.userId, [user_id]):
+                return jsonify({"error": "Balance not found for user."}), 404
+            return jsonify({"error": "Insufficient balance."}), 409
+        db.session.commit()
+        identity_cache.invalidate(user_id)
+        return jsonify(adjusted_balance(row)), 200
+
+
+@apiblp.route('/api/balances/adjust')
+class AdjustBalances(MethodView):
+    def post(self):
+        """Apply a list of adjustments ({"userId", "monetary", "bonus", "dataMB", "charge"}) in order, in one transaction."""
+        data = request.get_json()
+        if not isinstance(data, list):
+            data = [data]
+
+        for adjustment in data:
+            user_id = adjustment.get("userId") if isinstance(adjustment, dict) else None
+            error = adjustment_error(adjustment) or (None if isinstance(user_id, int) and not isinstance(user_id, bool)
+                                                     else "Each adjustment must have a userId.")
+            if error:
+                return jsonify({"error": error}), 400
+
+        rows = adjust_balances(data)
+        db.session.commit()
+        for user_id in {row.userId for row in rows if row is not None}:
+            identity_cache.invalidate(user_id)
+        return jsonify({
+            "balances": [adjusted_balance(row) for row in rows if row is not None],
+            "rejected": [index for index, row in enumerate(rows) if row is None],
+        }), 200
+
+
 # endpoints for recharge history simulated data------------------------------------------------------------------------------------------
 @apiblp.route('/api/recharges')
 class Recharges(MethodView):
     def get(self):
-        """Retrieve all recharges."""
-        recharges = Recharge.query.all()
-        return [
-            {
-                "id": recharge.id,
-                "userId": recharge.userId,
-                "rechargeAmount": recharge.rechargeAmount,
-                "rechargeDate": recharge.rechargeDate.isoformat() if recharge.rechargeDate else None,
-                "bonusAdded": recharge.bonusAdded,
-                "dataAddedMB": recharge.dataAddedMB,
-                "monetaryExpiryDate": recharge.monetaryExpiryDate.isoformat() if recharge.monetaryExpiryDate else None,
-                "bonusExpiryDate": recharge.bonusExpiryDate.isoformat() if recharge.bonusExpiryDate else None,
-                "dataExpiryDate": recharge.dataExpiryDate.isoformat() if recharge.dataExpiryDate else None,
-            }
-            for recharge in recharges
-        ], 200
+        """Retrieve recharges one page at a time, or all of them as NDJSON, optionally filtered by userId and from/to dates."""
+        page = page_arguments()
+        if page is None:
+            return jsonify({"error": PAGE_ERROR}), 400
+
+        query = filter_history(Recharge.query, Recharge, Recharge.rechargeDate)
+        if query is None:
+            return jsonify({"error": HISTORY_FILTER_ERROR}), 400
+
+        if wants_stream():
+            return ndjson_response(query, [Recharge.id, Recharge.userId, Recharge.rechargeAmount, Recharge.rechargeDate,
+                                           Recharge.bonusAdded, Recharge.dataAddedMB, Recharge.monetaryExpiryDate,
+                                           Recharge.bonusExpiryDate, Recharge.dataExpiryDate], page[0])
+
+        recharges, next_cursor = paginate(query, Recharge, *page)
+        return {
+            "items": [
+                {
+                    "id": recharge.id,
+                    "userId": recharge.userId,
+                    "rechargeAmount": recharge.rechargeAmount,
+                    "rechargeDate": recharge.rechargeDate.isoformat() if recharge.rechargeDate else None,
+                    "bonusAdded": recharge.bonusAdded,
+                    "dataAddedMB": recharge.dataAddedMB,
+                    "monetaryExpiryDate": recharge.monetaryExpiryDate.isoformat() if recharge.monetaryExpiryDate else None,
+                    "bonusExpiryDate": recharge.bonusExpiryDate.isoformat() if recharge.bonusExpiryDate else None,
+                    "dataExpiryDate": recharge.dataExpiryDate.isoformat() if recharge.dataExpiryDate else None,
+                }
+                for recharge in recharges
+            ],
+            "next_cursor": next_cursor,
+        }, 200
 
     def post(self):
-        """Add one or more recharges."""
+        """Add one or more recharges, ?bulk=1 inserts them in chunks and only returns counts."""
         data = request.get_json()
 
         if not isinstance(data, list):
             data = [data]  
 
+        if request.args.get("bulk") == "1":
+            from . import bulkIngest
+            return bulk_insert_response(Recharge, bulkIngest.validate_recharges, data)
+
         created_recharges = []
         for recharge_data in data:
             if "userId" not in recharge_data:
@@ -449,6 +853,8 @@ class Recharges(MethodView):
             })
 
         db.session.commit()
+        for user_id in {recharge["userId"] for recharge in created_recharges}:
+            model_cache.invalidate(user_id)
         return jsonify({"message": "Recharges added successfully.", "recharges": created_recharges}), 201
 
 
@@ -456,6 +862,7 @@ class Recharges(MethodView):
         """Delete all recharges."""
         num_deleted = db.session.query(Recharge).delete()
         db.session.commit()
+        model_cache.invalidate()
         return jsonify({"message": f"Deleted {num_deleted} recharges."}), 200
 
 
@@ -487,6 +894,7 @@ class SingleRecharge(MethodView):
 
         db.session.delete(recharge)
         db.session.commit()
+        model_cache.invalidate(recharge.userId)
         return jsonify({"message": f"Recharge with ID {recharge_id} deleted."}), 200
 
 
@@ -494,24 +902,15 @@ class SingleRecharge(MethodView):
 class UserRecharges(MethodView):
     def get(self, user_id):
         """Retrieve all recharges for a user by their ID."""
-        recharges = Recharge.query.filter_by(userId=user_id).all()
-        if not recharges:
+        recharges = recharge_columns(user_id)
+        if not len(recharges["id"]):
             return jsonify({"error": f"No recharges found for user with ID {user_id}."}), 404
 
-        return [
-            {
-                "id": recharge.id,
-                "userId": recharge.userId,
-                "rechargeAmount": recharge.rechargeAmount,
-                "rechargeDate": recharge.rechargeDate.isoformat() if recharge.rechargeDate else None,
-                "bonusAdded": recharge.bonusAdded,
-                "dataAddedMB": recharge.dataAddedMB,
-                "monetaryExpiryDate": recharge.monetaryExpiryDate.isoformat() if recharge.monetaryExpiryDate else None,
-                "bonusExpiryDate": recharge.bonusExpiryDate.isoformat() if recharge.bonusExpiryDate else None,
-                "dataExpiryDate": recharge.dataExpiryDate.isoformat() if recharge.dataExpiryDate else None,
-            }
-            for recharge in recharges
-        ], 200
+        result = to_records(recharges)
+        for record in result:
+            for field in ["rechargeDate", "monetaryExpiryDate", "bonusExpiryDate", "dataExpiryDate"]:
+                record[field] = record[field].isoformat() if record[field] else None
+        return result, 200
 
 
 # endpoints for monetary recharge plans simulated data------------------------------------------------------------------------------------------
@@ -559,6 +958,7 @@ class MonetaryRechargePlans(MethodView):
             })
 
         db.session.commit()
+        plan_catalog.invalidate()
         return jsonify({"message": "Plans added successfully.", "plans": created_plans}), 201
 
 
@@ -566,6 +966,7 @@ class MonetaryRechargePlans(MethodView):
         """Delete all recharge plans."""
         num_deleted = db.session.query(MonetaryRechargePlan).delete()
         db.session.commit()
+        plan_catalog.invalidate()
         return jsonify({"message": f"Deleted {num_deleted} recharge plans."}), 200
 
 
@@ -593,6 +994,7 @@ class SingleMonetaryRechargePlan(MethodView):
 
         db.session.delete(plan)
         db.session.commit()
+        plan_catalog.invalidate()
         return jsonify({"message": f"Plan with ID {plan_id} deleted."}), 200
 
 
@@ -637,6 +1039,7 @@ class MobileDataPlans(MethodView):
             })
 
         db.session.commit()
+        plan_catalog.invalidate()
         return jsonify({"message": "Mobile data plans added successfully.", "plans": created_plans}), 201
 
 
@@ -644,6 +1047,7 @@ class MobileDataPlans(MethodView):
         """Delete all mobile data plans."""
         num_deleted = db.session.query(MobileDataPlan).delete()
         db.session.commit()
+        plan_catalog.invalidate()
         return jsonify({"message": f"Deleted {num_deleted} mobile data plans."}), 200
 
 
@@ -670,9 +1074,73 @@ class SingleMobileDataPlan(MethodView):
 
         db.session.delete(plan)
         db.session.commit()
+        plan_catalog.invalidate()
         return jsonify({"message": f"Plan with ID {plan_id} deleted."}), 200
 
 
+# serialize plans of the plan catalog
+def monetary_plan_dict(plan):
+    return {
+        "id": plan.id,
+        "price": plan.price,
+        "rechargeAmount": plan.rechargeAmount,
+        "rechargeExpDays": plan.rechargeExpDays,
+        "bonusExpDays": plan.bonusExpDays,
+    }
+
+
+def data_plan_dict(plan):
+    return {
+        "id": plan.id,
+        "price": plan.price,
+        "dataAmountMB": plan.dataAmountMB,
+        "expDays": plan.expDays,
+    }
+
+
+@apiblp.route('/api/mobileDataPlans/cheapestPerMB')
+class CheapestMobileDataPlan(MethodView):
+    def get(self):
+        """Retrieve the mobile data plan with the lowest price per MB, among the plans adding at least min_mb MB."""
+        min_mb = request.args.get("min_mb", default=0, type=float)
+        if min_mb is None or min_mb < 0:
+            return jsonify({"error": "min_mb must be a non-negative number."}), 400
+
+        plan = plan_catalog.snapshot().cheapest_per_mb(min_mb)
+        if not plan:
+            return jsonify({"error": "No mobile data plan adds that much data."}), 404
+
+        return {**data_plan_dict(plan), "pricePerMB": plan.price / plan.dataAmountMB}, 200
+
+
+@apiblp.route('/api/plans/cover')
+class PlansCover(MethodView):
+    def get(self):
+        """Retrieve the smallest single plans and the cheapest combination of plans adding at least cost TDN and data_mb MB."""
+        cost = request.args.get("cost", default=0, type=float)
+        data_mb = request.args.get("data_mb", default=0, type=float)
+        # float() also parses "inf" and "nan"
+        if cost is None or data_mb is None or not math.isfinite(cost) or not math.isfinite(data_mb) or cost < 0 or data_mb < 0:
+            return jsonify({"error": "cost and data_mb must be non-negative numbers."}), 400
+
+        plans = plan_catalog.snapshot()
+        try:
+            combination = plans.cheapest_combination(cost, data_mb)
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
+
+        monetary_plan, data_plan = plans.recommend(cost, data_mb)
+        return {
+            "smallestMonetaryPlan": monetary_plan_dict(monetary_plan) if monetary_plan else None,
+            "smallestDataPlan": data_plan_dict(data_plan) if data_plan else None,
+            "cheapestCombination": {
+                "price": round(combination["price"], 3),
+                "monetaryPlans": [{**monetary_plan_dict(plan), "count": count} for plan, count in combination["monetaryPlans"]],
+                "dataPlans": [{**data_plan_dict(plan), "count": count} for plan, count in combination["dataPlans"]],
+            } if combination else None,
+        }, 200
+
+
 # endpoints for agencies location ------------------------------------------------------------------------------------------
 @apiblp.route('/api/agencyLocations')
 class AgencyLocations(MethodView):
@@ -721,15 +1189,72 @@ class AgencyLocations(MethodView):
             })
 
         db.session.commit()
+        agency_index.invalidate()
         return jsonify({"message": "Agency locations added successfully.", "locations": created_agencies}), 201
 
     def delete(self):
         """Delete all agency locations."""
         num_deleted = db.session.query(AgencyLocation).delete()
         db.session.commit()
+        agency_index.invalidate()
         return jsonify({"message": f"Deleted {num_deleted} agency locations."}), 200
 
 
+# serialize the (agency, distance) pairs returned by the agency index
+def agency_distances(results):
+    return [
+        {
+            "id": agency.id,
+            "name": agency.name,
+            "address": agency.address,
+            "phoneNumber": agency.phoneNumber,
+            "latitude": agency.latitude,
+            "longitude": agency.longitude,
+            "distanceKm": round(distance, 3),
+        }
+        for agency, distance in results
+    ]
+
+
+# read the lat/lng query parameters, returns None when missing, not finite or out of range
+def query_location():
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    if lat is None or lng is None or not math.isfinite(lat) or not math.isfinite(lng) or not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        return None
+    return lat, lng
+
+
+@apiblp.route('/api/agencyLocations/nearest')
+class NearestAgencyLocations(MethodView):
+    def get(self):
+        """Retrieve the k agency locations nearest to lat/lng, closest first."""
+        location = query_location()
+        if location is None:
+            return jsonify({"error": "Valid lat and lng query parameters are required."}), 400
+
+        k = request.args.get("k", default=5, type=int)
+        if k is None or k < 1:
+            return jsonify({"error": "k must be a positive integer."}), 400
+
+        return jsonify(agency_distances(agency_index.nearest(*location, k))), 200
+
+
+@apiblp.route('/api/agencyLocations/within')
+class AgencyLocationsWithin(MethodView):
+    def get(self):
+        """Retrieve the agency locations at most radius_km away from lat/lng, closest first."""
+        location = query_location()
+        if location is None:
+            return jsonify({"error": "Valid lat and lng query parameters are required."}), 400
+
+        radius_km = request.args.get("radius_km", type=float)
+        if radius_km is None or not math.isfinite(radius_km) or radius_km < 0:
+            return jsonify({"error": "radius_km must be a non-negative number."}), 400
+
+        return jsonify(agency_distances(agency_index.within(*location, radius_km))), 200
+
+
 @apiblp.route('/api/agencyLocations/<int:location_id>')
 class SingleAgencyLocation(MethodView):
     def get(self, location_id):
@@ -755,6 +1280,7 @@ class SingleAgencyLocation(MethodView):
 
         db.session.delete(agency)
         db.session.commit()
+        agency_index.invalidate()
         return jsonify({"message": f"Agency location with ID {location_id} deleted."}), 200
 
 
@@ -763,17 +1289,24 @@ class SingleAgencyLocation(MethodView):
 @apiblp.route('/api/questions')
 class QuestionsCheck(MethodView):
     def get(self):
-        """Retrieve all questions."""
-        questions = Question.query.all()
-        return [
-            {
-                "id": question.id,
-                "userId": question.userId,
-                "content": question.content,
-                "submittedAt": question.submittedAt.isoformat() 
-            }
-            for question in questions
-        ], 200
+        """Retrieve questions one page at a time."""
+        page = page_arguments()
+        if page is None:
+            return jsonify({"error": PAGE_ERROR}), 400
+
+        questions, next_cursor = paginate(Question.query, Question, *page)
+        return {
+            "items": [
+                {
+                    "id": question.id,
+                    "userId": question.userId,
+                    "content": question.content,
+                    "submittedAt": question.submittedAt.isoformat() 
+                }
+                for question in questions
+            ],
+            "next_cursor": next_cursor,
+        }, 200
 
     def delete(self):
         """Delete all questions."""
@@ -781,6 +1314,32 @@ class QuestionsCheck(MethodView):
         db.session.commit()
         return jsonify({"message": f"Deleted {num_deleted} questions."}), 200
 
+@apiblp.route('/api/questions/search')
+class SearchQuestions(MethodView):
+    def get(self):
+        """Search questions by keywords, best match first, ?offset=<next_offset of the previous page>&limit=<page size>."""
+        keyword = request.args.get("q", "").strip()
+        offset = int_argument("offset", 0)
+        limit = int_argument("limit", DEFAULT_PAGE_SIZE)
+        if not keyword:
+            return jsonify({"error": "q is required."}), 400
+        if offset is None or limit is None or offset < 0 or limit < 1:
+            return jsonify({"error": "offset must be a non-negative integer and limit a positive integer."}), 400
+
+        questions, next_offset = search_questions(keyword, offset, min(limit, MAX_PAGE_SIZE))
+        return {
+            "items": [
+                {
+                    "id": question.id,
+                    "userId": question.userId,
+                    "content": question.content,
+                    "submittedAt": question.submittedAt.isoformat()
+                }
+                for question in questions
+            ],
+            "next_offset": next_offset,
+        }, 200
+
 @apiblp.route('/api/questions/user/<int:user_id>')
 class UserQuestions(MethodView):
     def get(self, user_id):
@@ -816,18 +1375,25 @@ class DeleteQuestion(MethodView):
 @apiblp.route('/api/answers')
 class AnswersCheck(MethodView):
     def get(self):
-        """Retrieve all answers."""
-        answers = Answer.query.all()
-        return [
-            {
-                "id": answer.id,
-                "questionId": answer.questionId,
-                "userId": answer.userId,
-                "content": answer.content,
-                "submittedAt": answer.submittedAt.isoformat()  
-            }
-            for answer in answers
-        ], 200
+        """Retrieve answers one page at a time."""
+        page = page_arguments()
+        if page is None:
+            return jsonify({"error": PAGE_ERROR}), 400
+
+        answers, next_cursor = paginate(Answer.query, Answer, *page)
+        return {
+            "items": [
+                {
+                    "id": answer.id,
+                    "questionId": answer.questionId,
+                    "userId": answer.userId,
+                    "content": answer.content,
+                    "submittedAt": answer.submittedAt.isoformat()  
+                }
+                for answer in answers
+            ],
+            "next_cursor": next_cursor,
+        }, 200
 
     def delete(self):
         """Delete all answers."""
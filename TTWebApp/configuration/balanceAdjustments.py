@@ -0,0 +1,37 @@
+from sqlalchemy import and_, bindparam, case, update
+from .models import db, Balance
+
+# atomic balance adjustments, computed by the database in one guarded UPDATE ... RETURNING per user-------------------------------------
+# an adjustment adds signed deltas to the monetary, bonus and data balances, then spends a charge from the bonus balance first and
+# the monetary balance for the rest (the charging rule of dataSimulation/simulate.py); a balance never goes below zero, an
+# adjustment that would make one negative updates nothing
+# the new values are computed from the current row by the UPDATE itself, so concurrent adjustments of a user cannot overwrite
+# each other like a read, compute and PATCH sequence does
+
+ADJUSTMENT_FIELDS = ['monetary', 'bonus', 'dataMB', 'charge']
+
+RETURNED_COLUMNS = ['userId', 'monetaryBalance', 'bonusBalance', 'dataBalanceMB', 'monetaryExpiryDate', 'bonusExpiryDate', 'dataExpiryDate']
+
+
+def adjust_statement():
+    """UPDATE of the balance of :user_id by the :monetary, :bonus, :dataMB and :charge parameters, returning the new values."""
+    # a Core statement on the table, the ORM does not synchronize the session for it
+    table = Balance.__table__
+    bonus = table.c.bonusBalance + bindparam('bonus')
+    monetary = table.c.monetaryBalance + bindparam('monetary')
+    data = table.c.dataBalanceMB + bindparam('dataMB')
+    charge = bindparam('charge')
+    # part of the charge paid by the bonus balance, the set expressions all read the row before the update
+    from_bonus = case((bonus >= charge, charge), else_=bonus)
+    return (update(table)
+            .where(and_(table.c.userId == bindparam('user_id'), bonus >= 0, monetary >= 0, data >= 0, bonus + monetary >= charge))
+            .values(bonusBalance=bonus - from_bonus, monetaryBalance=monetary - (charge - from_bonus), dataBalanceMB=data)
+            .returning(*(table.c[name] for name in RETURNED_COLUMNS)))
+
+
+def adjust_balances(adjustments):
+    """Apply adjustments ({'userId': ..., 'monetary': ..., 'bonus': ..., 'dataMB': ..., 'charge': ...}, missing deltas are 0) in
+    order in the current transaction, returns the new balance row of each, or None when it was refused or the user has no balance."""
+    statement = adjust_statement()
+    return [db.session.execute(statement, {'user_id': adjustment['userId'], **{field: adjustment.get(field, 0) for field in ADJUSTMENT_FIELDS}})
+            .first() for adjustment in adjustments]
@@ -1,13 +1,16 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, make_response, current_app
 from flask import flash , request, url_for, redirect
 from flask_login import login_user, login_required, logout_user, current_user
-from .models import db, User, UsageHistory, Balance, Recharge, MonetaryRechargePlan, MobileDataPlan, AgencyLocation, Question, Answer
+from .models import db, User, Question, Answer
 from werkzeug.security import generate_password_hash, check_password_hash
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
-import pandas as pd
-import numpy as np
-from geopy.distance import geodesic
+from sqlalchemy.orm import joinedload
+from .forecasting import project_balance, recommend_plans
+from .predictionPipeline import StageTimer, load_inputs, needs_fit, compute_forecast
+from .predictionJobs import prediction_jobs, JobRejected
+from .agencyIndex import agency_index
+from .identityCache import identity_cache
+from .questionSearch import search_questions
+from .queryBudget import query_budget
 
 blp = Blueprint('blp', __name__)
 
@@ -59,6 +62,7 @@ def signup():
             user.username = username
             user.passwordHash = generate_password_hash(password, method='pbkdf2:sha256')  
             db.session.commit()
+            identity_cache.invalidate(user.id)
             login_user(user, remember=True)
             flash('your Account is successfully created!', category='S')
             return redirect(url_for('blp.home'))
@@ -77,8 +81,9 @@ def logout():
 @blp.route('/')
 @login_required
 def home():
-    balance = Balance.query.filter_by(userId=current_user.id).first()  
-    
+    # read with the user by the identity cache
+    balance = current_user.balance
+
     if not balance:
         balance = {
             'monetaryBalance': 0,
@@ -104,207 +109,114 @@ def home():
 @blp.route('/predict', methods=['POST'])
 @login_required
 def predict():
-    # Fetch user's usage history----------------------------------------------------------------------------------------------------------------
-    usage_history = UsageHistory.query.filter_by(userId=current_user.id).all()
-
-    if not usage_history:
-        return render_template("prediction.html", message="No usage history available for prediction.")
-
-    # Prepare data for linear regression
-    data = pd.DataFrame([{
-        'usageTimestamp': record.usageTimestamp,
-        'callsMinutes': record.callsMinutes,
-        'smsCount': record.smsCount,
-        'dataUsageMB': record.dataUsageMB
-    } for record in usage_history])
-
-    data['days_since_first'] = (data['usageTimestamp'] - data['usageTimestamp'].min()).dt.days
-
-    X = data[['days_since_first']]  # Features (days since first usage)
-    y_calls = data['callsMinutes']  # Target
-    y_sms = data['smsCount']  # Target
-    y_data = data['dataUsageMB']  # Target
-
-    # Fit 
-    model_calls = LinearRegression().fit(X, y_calls)
-    model_sms = LinearRegression().fit(X, y_sms)
-    model_data = LinearRegression().fit(X, y_data)
-
-    # Predict the next day
-    next_day = data['days_since_first'].max() + 1  
-    predicted_calls = model_calls.predict([[next_day]])[0]
-    predicted_sms = model_sms.predict([[next_day]])[0]
-    predicted_data = model_data.predict([[next_day]])[0]
-
-    predicted_sms = round(predicted_sms, 3)
-    predicted_calls = round(predicted_calls, 3)
-    predicted_data = round(predicted_data, 3)
-    
-    # Fetch user's recharge history---------------------------------------------------------------------------------------------------------
-    recharge_history = Recharge.query.filter_by(userId=current_user.id).all()
-
-    if not recharge_history:
-        return render_template("prediction.html", message="No recharge history available for prediction.",
-                               user=current_user,
-                               predicted_calls=predicted_calls,
-                               predicted_sms=predicted_sms,
-                               predicted_data=predicted_data)
-
-    recharge_data = pd.DataFrame([{
-        'rechargeDate': record.rechargeDate,
-        'rechargeAmount': record.rechargeAmount,
-        'bonusAdded': record.bonusAdded,
-        'dataAddedMB': record.dataAddedMB
-    } for record in recharge_history])
-
-    recharge_data['rechargeDate'] = pd.to_datetime(recharge_data['rechargeDate'])
+    return prediction_page()
 
-    recharge_data['days_since_first_recharge'] = (recharge_data['rechargeDate'] - recharge_data['rechargeDate'].min()).dt.days
 
-    X_recharge = recharge_data[['days_since_first_recharge']]  # Features (days since first recharge)
-    y_recharge_monetary = recharge_data['rechargeAmount']  # Target
-    y_recharge_data = recharge_data['dataAddedMB']  # Target
-
-    # Fit 
-    rf_model_monetary = RandomForestRegressor(n_estimators=100).fit(X_recharge, y_recharge_monetary)
-    rf_model_data = RandomForestRegressor(n_estimators=100).fit(X_recharge, y_recharge_data)
-
-    # Predict the next day
-    next_recharge_day = recharge_data['days_since_first_recharge'].max() + 1  
-    predicted_recharge_monetary = rf_model_monetary.predict([[next_recharge_day]])[0]
-    predicted_recharge_data = rf_model_data.predict([[next_recharge_day]])[0]
+# status page of a prediction computed in the worker pool, it shows the prediction once the models are fitted
+@blp.route('/predict/<job_id>')
+@login_required
+def prediction_job(job_id):
+    job = prediction_jobs.get(job_id, current_user.id)
+    if job is None:
+        flash('This prediction is no longer available, please start a new one.', category='E')
+        return redirect(url_for('blp.home'))
+    if job.failed():
+        current_app.logger.error("prediction job %s failed: %r", job.id, job.future.exception())
+        flash('The prediction could not be computed, please try again.', category='E')
+        return redirect(url_for('blp.home'))
+    if not job.done():
+        response = make_response(render_template("predictionPending.html", user=current_user, job_id=job.id), 202)
+        response.headers['Refresh'] = '2'
+        return response
+    return prediction_page()
+
+
+def prediction_page():
+    timer = StageTimer()
+
+    # Read everything the page needs in one stage---------------------------------------------------------------------------------------------
+    with timer.stage('load'):
+        inputs = load_inputs(current_user)
+    usage_count, _, recharge_count, _ = inputs.version
+
+    if not usage_count:
+        return timed_page(timer, render_template("prediction.html", message="No usage history available for prediction."))
+
+    # Models still to fit are sent to the worker pool, the page is then served by prediction_job-------------------------------------------
+    if current_app.config['PREDICT_ASYNC'] and needs_fit(inputs):
+        try:
+            job = prediction_jobs.submit(current_user.id, inputs)
+        except JobRejected as error:
+            flash(str(error), category='E')
+            return redirect(url_for('blp.home'))
+        if not job.done() or job.failed():
+            return redirect(url_for('blp.prediction_job', job_id=job.id))
+        # finished job of this history version, its models may have been evicted from the model cache since
+        inputs = inputs._replace(models={**inputs.models, **job.models()}, usage=None, recharges=None)
 
-    predicted_recharge_monetary = round(predicted_recharge_monetary, 3)
-    predicted_recharge_data = round(predicted_recharge_data, 3)
+    # Precomputed forecast, completed with the cached or newly fitted models------------------------------------------------------------------
+    with timer.stage('forecast'):
+        forecast = compute_forecast(current_user.id, inputs, current_user.bonusPlan)
 
-    user = User.query.filter_by(id=current_user.id).first()
-    bonus_plan = user.bonusPlan if user else 0  
+    if not recharge_count:
+        return timed_page(timer, render_template("prediction.html", message="No recharge history available for prediction.",
+                                                 user=current_user,
+                                                 predicted_calls=forecast['predicted_calls'],
+                                                 predicted_sms=forecast['predicted_sms'],
+                                                 predicted_data=forecast['predicted_data']))
 
-    bonus_prediction = predicted_recharge_monetary * bonus_plan
-    bonus_prediction = round(bonus_prediction, 3)  
+    if not inputs.balance:
+        return timed_page(timer, render_template("prediction.html", message="Balance information not available for the user."))
 
-    
-    sms_price = 0.025 
-    call_price = 0.035 
+    # Apply the forecast to the current balance-----------------------------------------------------------------------------------------------
+    with timer.stage('balance'):
+        predicted_balance = project_balance(forecast, *inputs.balance)
 
-    # Fetch the user's current balance details from the Balance table-------------------------------------------------------------
-    user_balance = Balance.query.filter_by(userId=current_user.id).first()
+    # Recommend plans-----------------------------------------------------------------------------------------------------------------------------  
+    with timer.stage('recommend'):
+        best_monetary_plan, best_data_plan = inputs.best_plans
+        if best_monetary_plan is None and best_data_plan is None:
+            best_monetary_plan, best_data_plan = recommend_plans(forecast, inputs.plans)
 
-    if not user_balance:
-        return render_template("prediction.html", message="Balance information not available for the user.")
+    with timer.stage('render'):
+        page = render_template("prediction.html",  user=current_user,
+                               **forecast,
+                               **predicted_balance,
+                               best_monetary_plan=best_monetary_plan,
+                               best_data_plan=best_data_plan,
+                               daily_stats=inputs.usage_stats,
+                               daily_recharge_stats=inputs.recharge_stats)
+    return timed_page(timer, page)
 
-    monetary_balance = user_balance.monetaryBalance  
-    bonus_balance = user_balance.bonusBalance  
-    data_balance = user_balance.dataBalanceMB 
 
-    sms_cost = predicted_sms * sms_price
-    call_cost = predicted_calls * call_price
+# the stage timings go in the Server-Timing header (shown by the browser developer tools) and in the debug log
+def timed_page(timer, page):
+    response = make_response(page)
+    response.headers['Server-Timing'] = timer.header()
+    current_app.logger.debug("predict stages: %s", timer.header())
+    return response
 
-    remaining_bonus_balance = bonus_balance - sms_cost - call_cost
 
-    if remaining_bonus_balance >= 0:
-        # If bonus balance is sufficient, use bonus balance
-        predicted_balance_bonus = remaining_bonus_balance
-        predicted_balance_monetary = monetary_balance 
-        predicted_balance_data = data_balance - predicted_data 
-    else:
-        # If bonus balance is not enough, use the monetary balance
-        predicted_balance_bonus = 0 
-        remaining_monetary_balance = monetary_balance + remaining_bonus_balance  
-        if remaining_monetary_balance >= 0:
-            predicted_balance_monetary = remaining_monetary_balance
-            predicted_balance_data = data_balance - predicted_data  
-        else:
-            predicted_balance_monetary = 0
-            predicted_balance_data = 0  
+# the question lists and the answers threads are shown one page at a time, their rows are read with the users they display
+SEARCH_PAGE_SIZE = 20
+QUESTIONS_PAGE_SIZE = 20
+ANSWERS_PAGE_SIZE = 50
 
-    predicted_balance_monetary += predicted_recharge_monetary
-    predicted_balance_bonus += bonus_prediction
-    predicted_balance_data += predicted_recharge_data
 
-    # Recommend plans-----------------------------------------------------------------------------------------------------------------------------  
-    # Predict usage for 7 days
-    predicted_week_sms = predicted_sms * 7
-    predicted_week_calls = predicted_calls * 7
-    predicted_week_data = predicted_data * 7
-
-    monetary_plans = MonetaryRechargePlan.query.all()
-
-    total_sms_cost = predicted_week_sms * sms_price
-    total_call_cost = predicted_week_calls * call_price
-    total_cost = total_sms_cost + total_call_cost
-
-    # Find the best monetary plan from the database
-    best_monetary_plan = None
-    for plan in monetary_plans:
-        if plan.rechargeAmount >= total_cost:
-            if not best_monetary_plan or plan.rechargeAmount < best_monetary_plan.rechargeAmount:
-                best_monetary_plan = plan
-
-    data_plans = MobileDataPlan.query.all()
-
-    best_data_plan = None
-    for plan in data_plans:
-        if plan.dataAmountMB >= predicted_week_data:
-            if not best_data_plan or plan.dataAmountMB < best_data_plan.dataAmountMB:
-                best_data_plan = plan
-    
-    data['usageTimestamp'] = pd.to_datetime(data['usageTimestamp'])
-    data['date'] = data['usageTimestamp'].dt.date 
-
-
-    # Group data by date to calculate daily statistics----------------------------------------------------------------------------
-    daily_stats = data.groupby('date').agg({
-        'callsMinutes': ['mean', 'std', 'median', lambda x: pd.Series.mode(x).iloc[0] if not x.mode().empty else np.nan],
-        'smsCount': ['mean', 'std', 'median', lambda x: pd.Series.mode(x).iloc[0] if not x.mode().empty else np.nan],
-        'dataUsageMB': ['mean', 'std', 'median', lambda x: pd.Series.mode(x).iloc[0] if not x.mode().empty else np.nan]
-    }).reset_index()
-
-    daily_stats.columns = ['date', 'calls_mean', 'calls_std', 'calls_median', 'calls_mode',
-                           'sms_mean', 'sms_std', 'sms_median', 'sms_mode',
-                           'data_usage_mean', 'data_usage_std', 'data_usage_median', 'data_usage_mode']
-
-    recharge_history = Recharge.query.filter_by(userId=current_user.id).all()
-    recharge_data = pd.DataFrame([{
-        'rechargeDate': record.rechargeDate,
-        'rechargeAmount': record.rechargeAmount,
-        'dataAddedMB': record.dataAddedMB
-    } for record in recharge_history])
-
-    recharge_data['rechargeDate'] = pd.to_datetime(recharge_data['rechargeDate'])
-    recharge_data['date'] = recharge_data['rechargeDate'].dt.date
-    daily_recharge_stats = recharge_data.groupby('date').agg({
-        'rechargeAmount': ['mean', 'std', 'median', lambda x: pd.Series.mode(x).iloc[0] if not x.mode().empty else np.nan],
-        'dataAddedMB': ['mean', 'std', 'median', lambda x: pd.Series.mode(x).iloc[0] if not x.mode().empty else np.nan]
-    }).reset_index()
-
-    daily_recharge_stats.columns = ['date', 'recharge_mean', 'recharge_std', 'recharge_median', 'recharge_mode',
-                                    'data_recharge_mean', 'data_recharge_std', 'data_recharge_median', 'data_recharge_mode']
-
-    latest_daily_usage = daily_stats.iloc[-1] if len(daily_stats) > 0 else None
-    latest_daily_recharge = daily_recharge_stats.iloc[-1] if len(daily_recharge_stats) > 0 else None
-
-    return render_template("prediction.html",  user=current_user,
-                           predicted_calls=predicted_calls,
-                           predicted_sms=predicted_sms,
-                           predicted_data= predicted_data,
-                           predicted_recharge_monetary=predicted_recharge_monetary,
-                           predicted_recharge_data=predicted_recharge_data,
-                           bonus_prediction=bonus_prediction,
-                           predicted_balance_monetary=round(predicted_balance_monetary, 3),
-                           predicted_balance_bonus=round(predicted_balance_bonus, 3),
-                           predicted_balance_data=round(predicted_balance_data, 3),
-                           best_monetary_plan=best_monetary_plan,
-                           best_data_plan=best_data_plan,
-                           daily_stats=latest_daily_usage,
-                           daily_recharge_stats=latest_daily_recharge)
+def page_of(query, page, page_size):
+    """Rows of a 1-based page of an ordered query, and whether a next page exists."""
+    rows = query.limit(page_size + 1).offset((page - 1) * page_size).all() if page > 0 else []
+    return rows[:page_size], len(rows) > page_size
 
 
 @blp.route('/questions', methods=['GET', 'POST'])
 @login_required
+@query_budget(6)
 def questions():
     keyword = request.args.get('keyword', '')
-    questions = []
+    page = request.args.get('page', 1, type=int)
+    questions_page = request.args.get('questions_page', 1, type=int)
+    questions, next_offset = [], None
     
     if request.method == 'POST': 
         question = request.form.get('question') 
@@ -319,17 +231,25 @@ def questions():
 
         return redirect(url_for('blp.questions')) 
 
-    # Search functionality
-    if keyword:
-        questions = Question.query.filter(Question.content.ilike(f'%{keyword}%')).all()
+    # Search functionality, ranked by the full-text index and one page at a time
+    if keyword and page > 0:
+        questions, next_offset = search_questions(keyword, (page - 1) * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE)
 
-    return render_template("questions.html", user=current_user, questions=questions, keyword=keyword)
+    # questions of the user, newest first
+    user_questions, has_next_questions = page_of(Question.query.filter_by(userId=current_user.id).order_by(Question.id.desc()),
+                                                 questions_page, QUESTIONS_PAGE_SIZE)
+
+    return render_template("questions.html", user=current_user, questions=questions, keyword=keyword,
+                           page=page, has_next=next_offset is not None,
+                           user_questions=user_questions, questions_page=questions_page, has_next_questions=has_next_questions)
 
 
 @blp.route('/question/<int:question_id>', methods=['GET', 'POST'])
 @login_required
+@query_budget(4)
 def answers(question_id):
-    question = Question.query.get_or_404(question_id)
+    page = request.args.get('page', 1, type=int)
+    question = Question.query.options(joinedload(Question.user)).filter_by(id=question_id).first_or_404()
     
     if request.method == 'POST':
         answer_content = request.form.get('answer')
@@ -342,7 +262,11 @@ def answers(question_id):
             flash('Your answer has been added successfully!', category='S')
             return redirect(url_for('blp.answers', question_id=question.id))
 
-    return render_template("answers.html", user=current_user, question=question)
+    # the thread in answering order, with the authors
+    answers, has_next = page_of(Answer.query.options(joinedload(Answer.user)).filter_by(questionId=question_id).order_by(Answer.id),
+                                page, ANSWERS_PAGE_SIZE)
+
+    return render_template("answers.html", user=current_user, question=question, answers=answers, page=page, has_next=has_next)
 
 
 @blp.route('/find', methods=['GET', 'POST'])
@@ -356,20 +280,9 @@ def findAgency():
         user_lat = float(request.form.get('latitude'))
         user_lng = float(request.form.get('longitude'))
 
-        agencies = AgencyLocation.query.all()
-
-        closest_distance = float('inf')
-
-        for agency in agencies:
-            agency_location = (agency.latitude, agency.longitude)
-            user_location = (user_lat, user_lng)
-            distance = geodesic(user_location, agency_location).meters  
-
-            if distance < closest_distance:
-                closest_distance = distance
-                closest_agency = agency
+        closest_agency, _ = agency_index.closest(user_lat, user_lng)
 
-    agencies = AgencyLocation.query.all()
+    agencies = agency_index.all()
 
     return render_template("findAgency.html", 
                            user=current_user, 
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert
+from .models import db
+
+# bulk ingestion of usage history and recharges (?bulk=1 on their POST endpoints)---------------------------------------------------
+# the whole payload is validated at once with column-wise checks, then the valid rows are inserted with executemany in
+# chunks of chunk_size rows, each chunk in its own transaction, invalid rows are reported by their index in the payload
+
+USAGE_FIELDS = ['userId', 'usageTimestamp', 'callsMinutes', 'smsCount', 'dataUsageMB']
+RECHARGE_FIELDS = ['userId', 'rechargeAmount', 'rechargeDate', 'bonusAdded', 'dataAddedMB',
+                   'monetaryExpiryDate', 'bonusExpiryDate', 'dataExpiryDate']
+
+
+def _frame(records, fields):
+    # entries that are not objects become empty rows, so they are rejected like rows missing their fields
+    return pd.DataFrame([record if isinstance(record, dict) else {} for record in records], columns=fields,
+                        index=range(len(records)))
+
+
+def _numbers(column):
+    """Return the column as floats and a mask of the provided values that are not numbers."""
+    numbers = pd.to_numeric(column.where(column.map(lambda value: not isinstance(value, (bool, str)))), errors='coerce')
+    return numbers, column.notna() & numbers.isna()
+
+
+def _user_ids(frame):
+    user_ids, invalid = _numbers(frame['userId'])
+    return user_ids, invalid | user_ids.isna() | (user_ids != np.floor(user_ids))
+
+
+def _dates(column, date_format):
+    """Return the column as timestamps and a mask of the provided values that are not valid dates."""
+    dates = pd.to_datetime(column.where(column.map(lambda value: isinstance(value, str))), format=date_format, errors='coerce')
+    return dates, column.notna() & dates.isna()
+
+
+def _optional_dates(dates, keep):
+    return pd.Series(dates.dt.date, dtype=object).where(keep & dates.notna(), None)
+
+
+def _records(columns):
+    # plain dicts of python values, as taken by executemany
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*(column.tolist() for column in columns.values()))]
+
+
+def validate_usage(records):
+    """Return the insertable usage rows and the indexes of the rejected records."""
+    frame = _frame(records, USAGE_FIELDS)
+    user_ids, invalid = _user_ids(frame)
+    timestamps, bad_timestamps = _dates(frame['usageTimestamp'], 'ISO8601')
+    invalid |= bad_timestamps | timestamps.isna()
+
+    # at least one of the counters must be provided, the missing ones default to 0
+    # the counters are finite and never negative, and the minutes and sms are whole numbers (they are not rounded)
+    invalid |= frame[['callsMinutes', 'smsCount', 'dataUsageMB']].isna().all(axis=1)
+    counters = {}
+    for field in ['callsMinutes', 'smsCount', 'dataUsageMB']:
+        counters[field], bad_numbers = _numbers(frame[field])
+        invalid |= bad_numbers | (counters[field] < 0) | (counters[field].notna() & ~np.isfinite(counters[field]))
+        if field != 'dataUsageMB':
+            invalid |= counters[field].notna() & (counters[field] != np.floor(counters[field]))
+
+    valid = ~invalid
+    rows = _records({
+        'userId': user_ids[valid].astype(int),
+        'usageTimestamp': timestamps[valid].dt.to_pydatetime(),
+        'callsMinutes': counters['callsMinutes'][valid].fillna(0).astype(int),
+        'smsCount': counters['smsCount'][valid].fillna(0).astype(int),
+        'dataUsageMB': counters['dataUsageMB'][valid].fillna(0.0),
+    })
+    return rows, frame.index[invalid].tolist()
+
+
+def validate_recharges(records):
+    """Return the insertable recharge rows and the indexes of the rejected records."""
+    frame = _frame(records, RECHARGE_FIELDS)
+    user_ids, invalid = _user_ids(frame)
+
+    # the amounts are finite and never negative, the missing ones default to 0
+    amounts = {}
+    for field in ['rechargeAmount', 'bonusAdded', 'dataAddedMB']:
+        amounts[field], bad_numbers = _numbers(frame[field])
+        amounts[field] = amounts[field].fillna(0.0)
+        invalid |= bad_numbers | (amounts[field] < 0) | ~np.isfinite(amounts[field])
+
+    # a recharge is either monetary/bonus or data, and not empty
+    monetary = (amounts['rechargeAmount'] > 0) | (amounts['bonusAdded'] > 0)
+    invalid |= monetary & (amounts['dataAddedMB'] > 0)
+    invalid |= (amounts['rechargeAmount'] == 0) & (amounts['bonusAdded'] == 0) & (amounts['dataAddedMB'] == 0)
+
+    dates = {}
+    for field in ['rechargeDate', 'monetaryExpiryDate', 'bonusExpiryDate', 'dataExpiryDate']:
+        dates[field], bad_dates = _dates(frame[field], '%Y-%m-%d')
+        invalid |= bad_dates
+
+    valid = ~invalid
+    rows = _records({
+        'userId': user_ids[valid].astype(int),
+        'rechargeAmount': amounts['rechargeAmount'][valid],
+        'rechargeDate': _optional_dates(dates['rechargeDate'], valid)[valid],
+        'bonusAdded': amounts['bonusAdded'][valid],
+        'dataAddedMB': amounts['dataAddedMB'][valid],
+        # expiry dates are only kept for the balances the recharge adds to
+        'monetaryExpiryDate': _optional_dates(dates['monetaryExpiryDate'], amounts['rechargeAmount'] > 0)[valid],
+        'bonusExpiryDate': _optional_dates(dates['bonusExpiryDate'], amounts['bonusAdded'] > 0)[valid],
+        'dataExpiryDate': _optional_dates(dates['dataExpiryDate'], amounts['dataAddedMB'] > 0)[valid],
+    })
+    return rows, frame.index[invalid].tolist()
+
+
+def insert_chunks(model, rows, chunk_size, on_chunk=None):
+    """Insert the rows with executemany, committing every chunk_size rows, on_chunk(rows) runs in each chunk's transaction."""
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(insert(model.__table__), rows[start:start + chunk_size])
+        if on_chunk is not None:
+            on_chunk(rows[start:start + chunk_size])
+        db.session.commit()
+    return len(rows)
@@ -1,3 +1,49 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 
 db = SQLAlchemy()
+
+# the INSERT constructs with ON CONFLICT clauses (upserts) of the supported databases
+UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+# engine settings of the app config (see settings.py)------------------------------------------------------------------------------
+def engine_options(config):
+    """Pool options of SQLALCHEMY_ENGINE_OPTIONS for the configured database, the options set in the config take precedence."""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {}
+    if url.get_backend_name() == 'sqlite':
+        # an in-memory database lives in a single connection, Flask-SQLAlchemy sets its pool
+        if url.database and url.database != ':memory:':
+            options.update(pool_size=config['DATABASE_POOL_SIZE'], max_overflow=config['DATABASE_MAX_OVERFLOW'])
+    else:
+        options.update(pool_size=config['DATABASE_POOL_SIZE'], max_overflow=config['DATABASE_MAX_OVERFLOW'],
+                       pool_pre_ping=config['DATABASE_POOL_PRE_PING'], pool_recycle=config['DATABASE_POOL_RECYCLE'])
+    return {**options, **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+
+
+def sqlite_pragmas(config):
+    pragmas = {
+        'journal_mode': config['SQLITE_JOURNAL_MODE'],
+        'synchronous': config['SQLITE_SYNCHRONOUS'],
+        'mmap_size': config['SQLITE_MMAP_SIZE'],
+        'busy_timeout': config['SQLITE_BUSY_TIMEOUT_MS'],
+    }
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+def configure_engines(config):
+    """Run the SQLite pragmas of the config on every new connection of the SQLite engines, in an app context."""
+    pragmas = sqlite_pragmas(config)
+    for engine in db.engines.values():
+        if engine.dialect.name != 'sqlite' or not pragmas:
+            continue
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
@@ -0,0 +1,74 @@
+import numpy as np
+
+# interchangeable forecasters of the recharge amounts, chosen with the RECHARGE_FORECASTER app setting-------------------------------
+# a forecaster follows the scikit-learn regressor interface: fit(X, y) then predict(X), where the single feature of X is the
+# number of days since the first recharge, so RandomForestRegressor itself is one
+# the values of a day are averaged, the other backends forecast the series of these daily values
+# scikit-learn is imported by the first forest built, the other backends never load it
+
+
+def _daily_values(X, y):
+    """Sorted distinct days of X and the mean of y on each of them."""
+    days, inverse = np.unique(np.asarray(X, dtype=np.float64)[:, 0], return_inverse=True)
+    values = np.bincount(inverse, weights=np.asarray(y, dtype=np.float64)) / np.bincount(inverse)
+    return days, values
+
+
+class ExponentialSmoothing:
+    """Simple exponential smoothing of the daily values, the forecast of any later day is the last smoothed level."""
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+
+    def fit(self, X, y):
+        _, values = _daily_values(X, y)
+        level = values[0]
+        for value in values[1:]:
+            level = self.alpha * value + (1 - self.alpha) * level
+        self.level_ = level
+        return self
+
+    def predict(self, X):
+        return np.full(len(X), self.level_)
+
+
+class SeasonalAverage:
+    """Mean of the daily values of the same weekday (days apart by a multiple of period) over the last seasons."""
+    def __init__(self, period=7, seasons=4):
+        self.period = period
+        self.seasons = seasons
+
+    def fit(self, X, y):
+        self.days_, self.values_ = _daily_values(X, y)
+        return self
+
+    def predict(self, X):
+        predictions = []
+        for day in np.asarray(X, dtype=np.float64)[:, 0]:
+            recent = (self.days_ < day) & (self.days_ >= day - self.period * self.seasons)
+            same_season = recent & ((day - self.days_) % self.period == 0)
+            # no value on the same weekday recently: mean of the recent days, or of the whole history
+            selected = same_season if same_season.any() else recent if recent.any() else np.ones(len(self.days_), dtype=bool)
+            predictions.append(self.values_[selected].mean())
+        return np.array(predictions)
+
+
+def _random_forest(**options):
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(**options)
+
+
+RECHARGE_FORECASTERS = {
+    # the original model, 100 unseeded trees
+    'random_forest': lambda **options: _random_forest(**{'n_estimators': 100, **options}),
+    # a few seeded trees, the forecasts are reproducible
+    'small_forest': lambda **options: _random_forest(**{'n_estimators': 10, 'n_jobs': 1, 'random_state': 0, **options}),
+    'exponential_smoothing': ExponentialSmoothing,
+    'seasonal_average': SeasonalAverage,
+}
+
+
+def make_forecaster(name, options=None):
+    """New unfitted forecaster of the given backend, options are passed to its constructor."""
+    if name not in RECHARGE_FORECASTERS:
+        raise ValueError(f"Unknown recharge forecaster {name!r}, expected one of {', '.join(RECHARGE_FORECASTERS)}")
+    return RECHARGE_FORECASTERS[name](**(options or {}))
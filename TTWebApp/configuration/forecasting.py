@@ -0,0 +1,127 @@
+from .regression import fit_lines, predict_lines
+from .forecasters import make_forecaster
+
+# these helpers hold the forecasting logic of the prediction page, they only work on plain data so they can be
+# shared by the /predict route, the model cache and the offline batch job (batchForecast.py)
+# pandas is imported by the first model fit, not with the web application (see benchmarks/importBenchmark.py)
+
+sms_price = 0.025
+call_price = 0.035
+
+
+# Prepare the history tables------------------------------------------------------------------------------------------------------
+def usage_frame(records):
+    """Build the usage DataFrame from (usageTimestamp, callsMinutes, smsCount, dataUsageMB) rows or {column: array}."""
+    import pandas as pd
+    data = pd.DataFrame(records, columns=['usageTimestamp', 'callsMinutes', 'smsCount', 'dataUsageMB'])
+    data['usageTimestamp'] = pd.to_datetime(data['usageTimestamp'])
+    data['days_since_first'] = (data['usageTimestamp'] - data['usageTimestamp'].min()).dt.days
+    return data
+
+
+def recharge_frame(records):
+    """Build the recharge DataFrame from (rechargeDate, rechargeAmount, bonusAdded, dataAddedMB) rows or {column: array}."""
+    import pandas as pd
+    recharge_data = pd.DataFrame(records, columns=['rechargeDate', 'rechargeAmount', 'bonusAdded', 'dataAddedMB'])
+    recharge_data['rechargeDate'] = pd.to_datetime(recharge_data['rechargeDate'])
+    recharge_data['days_since_first_recharge'] = (recharge_data['rechargeDate'] - recharge_data['rechargeDate'].min()).dt.days
+    return recharge_data
+
+
+# Fit the models------------------------------------------------------------------------------------------------------------------
+def fit_usage_models(data):
+    """Fit the calls, sms and data usage lines on the days_since_first feature."""
+    slopes, intercepts = fit_lines(data['days_since_first'].to_numpy(), data[['callsMinutes', 'smsCount', 'dataUsageMB']].to_numpy())
+    return {
+        'slopes': slopes,
+        'intercepts': intercepts,
+        'next_day': data['days_since_first'].max() + 1,
+    }
+
+
+def fit_recharge_models(recharge_data, forecaster='random_forest', options=None):
+    """Fit the monetary and data recharge models on the days_since_first_recharge feature, with a backend of forecasters.py."""
+    X_recharge = recharge_data[['days_since_first_recharge']].to_numpy()  # Features (days since first recharge)
+    return {
+        'monetary': make_forecaster(forecaster, options).fit(X_recharge, recharge_data['rechargeAmount'].to_numpy()),
+        'data': make_forecaster(forecaster, options).fit(X_recharge, recharge_data['dataAddedMB'].to_numpy()),
+        'next_day': recharge_data['days_since_first_recharge'].max() + 1,
+    }
+
+
+# Predict the next day--------------------------------------------------------------------------------------------------------------
+def forecast_usage(usage_models):
+    """Predict the next day calls, sms and data usage."""
+    predicted_calls, predicted_sms, predicted_data = predict_lines(usage_models['slopes'], usage_models['intercepts'], usage_models['next_day'])
+    return {
+        'predicted_calls': round(predicted_calls, 3),
+        'predicted_sms': round(predicted_sms, 3),
+        'predicted_data': round(predicted_data, 3),
+    }
+
+
+def forecast_recharge(recharge_models, bonus_plan):
+    """Predict the next day monetary and data recharge, and the bonus the monetary recharge adds."""
+    next_recharge_day = recharge_models['next_day']
+    predicted_recharge_monetary = round(recharge_models['monetary'].predict([[next_recharge_day]])[0], 3)
+    return {
+        'predicted_recharge_monetary': predicted_recharge_monetary,
+        'predicted_recharge_data': round(recharge_models['data'].predict([[next_recharge_day]])[0], 3),
+        'bonus_prediction': round(predicted_recharge_monetary * bonus_plan, 3),
+    }
+
+
+# Predicted balance and plan recommendation----------------------------------------------------------------------------------------
+def project_balance(forecast, monetary_balance, bonus_balance, data_balance):
+    """Apply the predicted usage and recharge to the current balance, using bonus before monetary balance."""
+    sms_cost = forecast['predicted_sms'] * sms_price
+    call_cost = forecast['predicted_calls'] * call_price
+
+    remaining_bonus_balance = bonus_balance - sms_cost - call_cost
+
+    if remaining_bonus_balance >= 0:
+        # If bonus balance is sufficient, use bonus balance
+        predicted_balance_bonus = remaining_bonus_balance
+        predicted_balance_monetary = monetary_balance
+        predicted_balance_data = data_balance - forecast['predicted_data']
+    else:
+        # If bonus balance is not enough, use the monetary balance
+        predicted_balance_bonus = 0
+        remaining_monetary_balance = monetary_balance + remaining_bonus_balance
+        if remaining_monetary_balance >= 0:
+            predicted_balance_monetary = remaining_monetary_balance
+            predicted_balance_data = data_balance - forecast['predicted_data']
+        else:
+            predicted_balance_monetary = 0
+            predicted_balance_data = 0
+
+    predicted_balance_monetary += forecast['predicted_recharge_monetary']
+    predicted_balance_bonus += forecast['bonus_prediction']
+    predicted_balance_data += forecast['predicted_recharge_data']
+
+    return {
+        'predicted_balance_monetary': round(predicted_balance_monetary, 3),
+        'predicted_balance_bonus': round(predicted_balance_bonus, 3),
+        'predicted_balance_data': round(predicted_balance_data, 3),
+    }
+
+
+def weekly_needs(forecast):
+    """Predicted usage of the next 7 days, as (cost of the calls and SMS in TDN, data in MB)."""
+    predicted_week_sms = forecast['predicted_sms'] * 7
+    predicted_week_calls = forecast['predicted_calls'] * 7
+    predicted_week_data = forecast['predicted_data'] * 7
+    return predicted_week_sms * sms_price + predicted_week_calls * call_price, predicted_week_data
+
+
+def recommend_plans(forecast, plans):
+    """Find the smallest monetary and data plans covering the predicted usage of the next 7 days, plans is a PlanSnapshot."""
+    return plans.recommend(*weekly_needs(forecast))
+
+
+# everything the batch job stores for one user, usage_records/recharge_records are rows as taken by usage_frame/recharge_frame
+def forecast_user(usage_records, recharge_records, bonus_plan, forecaster='random_forest', options=None):
+    forecast = forecast_usage(fit_usage_models(usage_frame(usage_records)))
+    if recharge_records:
+        forecast.update(forecast_recharge(fit_recharge_models(recharge_frame(recharge_records), forecaster, options), bonus_plan))
+    return forecast
@@ -0,0 +1,67 @@
+import numpy as np
+
+# vectorized per group mean, std, median and mode, used for the daily statistics of the prediction page
+# the rows are sorted once per column by (group, value) so every group is a contiguous slice of sorted values: the mean and std
+# are reductions over the slices, the median is read in the middle of each slice and the mode is the longest run of equal values
+# the results match pandas groupby().agg(['mean', 'std', 'median', lambda x: x.mode().iloc[0]]), missing values are skipped
+
+STATISTICS = ['mean', 'std', 'median', 'mode']
+
+
+def _group_statistics(group_ids, starts, values):
+    """Statistics of values per group, group_ids[i] is the group of values[i] and starts[g] the first row of group g once sorted."""
+    # one integer sort by (group, value): the ranks of the values are distinct, so group * n + rank orders the rows by group
+    # then by value, with NaN last (cheaper than np.lexsort on the two keys)
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[np.argsort(values)] = np.arange(len(values))
+    order = np.argsort(group_ids * len(values) + ranks)
+    values = values[order]
+    group_of = group_ids[order]
+    n_groups = len(starts)
+
+    # NaN sorts last, so the valid values of group g are the first counts[g] values of its slice
+    valid = ~np.isnan(values)
+    counts = np.bincount(group_of, weights=valid, minlength=n_groups).astype(np.int64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(group_of, weights=np.where(valid, values, 0.0), minlength=n_groups) / counts
+        deviations = np.where(valid, values - mean[group_of], 0.0)
+        std = np.sqrt(np.bincount(group_of, weights=deviations * deviations, minlength=n_groups) / (counts - 1))
+    std[counts < 2] = np.nan
+
+    low = starts + np.maximum(counts - 1, 0) // 2
+    high = starts + counts // 2
+    median = np.where(counts > 0, (values[low] + values[np.minimum(high, len(values) - 1)]) / 2, np.nan)
+
+    # runs of equal valid values, the mode of a group is the value of its first longest run (the smallest most frequent value)
+    new_run = np.ones(len(values), dtype=bool)
+    new_run[1:] = (values[1:] != values[:-1]) | (group_of[1:] != group_of[:-1])
+    run_start = np.flatnonzero(new_run)
+    run_length = np.diff(np.append(run_start, len(values)))
+    run_start, run_length = run_start[valid[run_start]], run_length[valid[run_start]]
+    run_group = group_of[run_start]
+    mode = np.full(n_groups, np.nan)
+    if len(run_start):
+        group_first_run = np.flatnonzero(np.concatenate(([True], run_group[1:] != run_group[:-1])))
+        longest = np.maximum.reduceat(run_length, group_first_run)
+        candidates = np.flatnonzero(run_length == np.repeat(longest, np.diff(np.append(group_first_run, len(run_start)))))
+        first = candidates[np.concatenate(([True], run_group[candidates][1:] != run_group[candidates][:-1]))]
+        mode[run_group[first]] = values[run_start[first]]
+    return {'mean': mean, 'std': std, 'median': median, 'mode': mode}
+
+
+def group_statistics(groups, columns):
+    """Mean, std, median and mode of every column per group, returns (sorted group keys, {column: {statistic: array}})."""
+    keys, group_ids, counts = np.unique(np.asarray(groups), return_inverse=True, return_counts=True)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    statistics = {}
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if not len(values):
+            statistics[name] = {statistic: np.empty(0) for statistic in STATISTICS}
+            continue
+        statistics[name] = _group_statistics(group_ids, starts, values.astype(np.float64))
+        # integer columns keep integer modes, like pandas
+        if np.issubdtype(values.dtype, np.integer):
+            statistics[name]['mode'] = statistics[name]['mode'].astype(values.dtype)
+    return keys, statistics
@@ -0,0 +1,64 @@
+import numpy as np
+from sqlalchemy import String, select, type_coerce
+from .models import db, UsageHistory, Recharge
+
+# columnar read-only access to the usage and recharge history, shared by the web views and the api------------------------------------
+# the rows are read with Core selects, without building ORM instances, and decoded column by column into typed NumPy arrays
+# dates and timestamps are read as the ISO strings SQLite stores and parsed by NumPy in one call per column
+# counts are int32, amounts stay float64 so the values served by the api are exactly the stored ones, missing values are NaN/NaT
+
+USAGE_COLUMNS = {
+    'id': (UsageHistory.id, np.int64),
+    'userId': (UsageHistory.userId, np.int32),
+    'usageTimestamp': (UsageHistory.usageTimestamp, 'datetime64[us]'),
+    'callsMinutes': (UsageHistory.callsMinutes, np.int32),
+    'smsCount': (UsageHistory.smsCount, np.int32),
+    'dataUsageMB': (UsageHistory.dataUsageMB, np.float64),
+}
+
+RECHARGE_COLUMNS = {
+    'id': (Recharge.id, np.int64),
+    'userId': (Recharge.userId, np.int32),
+    'rechargeAmount': (Recharge.rechargeAmount, np.float64),
+    'rechargeDate': (Recharge.rechargeDate, 'datetime64[D]'),
+    'bonusAdded': (Recharge.bonusAdded, np.float64),
+    'dataAddedMB': (Recharge.dataAddedMB, np.float64),
+    'monetaryExpiryDate': (Recharge.monetaryExpiryDate, 'datetime64[D]'),
+    'bonusExpiryDate': (Recharge.bonusExpiryDate, 'datetime64[D]'),
+    'dataExpiryDate': (Recharge.dataExpiryDate, 'datetime64[D]'),
+}
+
+
+def _read(model, columns, user_id, names):
+    selected = {name: columns[name] for name in (names or columns)}
+    # date columns are selected as their stored text, skipping the per row conversion to datetime objects
+    statement = select(*(type_coerce(column, String) if np.dtype(dtype).kind == 'M' else column
+                         for column, dtype in selected.values()))
+    if user_id is not None:
+        statement = statement.where(model.userId == user_id)
+    # executed on the connection, an ORM session execute would add per row ORM result processing
+    rows = db.session.connection().execute(statement.order_by(model.id)).all()
+    values = list(zip(*rows)) if rows else [()] * len(selected)
+    return {name: np.array(column_values, dtype=dtype) for (name, (_, dtype)), column_values in zip(selected.items(), values)}
+
+
+def usage_columns(user_id=None, names=None):
+    """Usage history of one user (or of everyone) in id order, as {column: array} for the given column names (default all)."""
+    return _read(UsageHistory, USAGE_COLUMNS, user_id, names)
+
+
+def recharge_columns(user_id=None, names=None):
+    """Recharge history of one user (or of everyone) in id order, as {column: array} for the given column names (default all)."""
+    return _read(Recharge, RECHARGE_COLUMNS, user_id, names)
+
+
+def to_records(columns):
+    """Convert {column: array} to one dict of Python values per row, with None for the missing values."""
+    values = []
+    for array in columns.values():
+        # NaT already converts to None
+        if array.dtype.kind == 'f' and np.isnan(array).any():
+            values.append([None if missing else value for value, missing in zip(array.tolist(), np.isnan(array).tolist())])
+        else:
+            values.append(array.tolist())
+    return [dict(zip(columns, row)) for row in zip(*values)]
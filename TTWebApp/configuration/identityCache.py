@@ -0,0 +1,95 @@
+import time
+from collections import namedtuple, OrderedDict
+from threading import Lock
+from flask_login import UserMixin
+from sqlalchemy import select
+from .models import db, User, Balance, Question
+
+# in-process cache of the logged-in users, read by flask_login's user loader on every authenticated request------------------------
+# an entry is a detached snapshot of the user row and of its balance, both read by one joined query; entries expire after
+# ttl_seconds and are evicted in LRU order beyond max_entries
+# the api endpoints writing users, balances or usage history invalidate the entries they touch, the TTL bounds how long a
+# change made elsewhere (another process, a batch job) can stay unseen
+
+BalanceSnapshot = namedtuple('BalanceSnapshot', ['monetaryBalance', 'monetaryExpiryDate', 'bonusBalance', 'bonusExpiryDate',
+                                                 'dataBalanceMB', 'dataExpiryDate'])
+
+
+class UserSnapshot(UserMixin):
+    """Read-only copy of a user and its balance (None without balance), with the attributes of User the pages use."""
+    def __init__(self, id, phoneNumber, username, bonusPlan, balance):
+        self.id = id
+        self.phoneNumber = phoneNumber
+        self.username = username
+        self.bonusPlan = bonusPlan
+        self.balance = balance
+
+    @property
+    def questions(self):
+        """The questions of the user in submission order, like User.questions but read on every access (not cached)."""
+        return Question.query.filter_by(userId=self.id).order_by(Question.id).all()
+
+
+def load_snapshot(user_id):
+    """Read a user and its balance in one query, returns a UserSnapshot or None when the user does not exist."""
+    row = db.session.execute(
+        select(User.id, User.phoneNumber, User.username, User.bonusPlan, *(getattr(Balance, name) for name in BalanceSnapshot._fields),
+               Balance.id.label('balanceId'))
+        .outerjoin(Balance, Balance.userId == User.id)
+        .where(User.id == user_id)).first()
+    if row is None:
+        return None
+    balance = BalanceSnapshot(*row[4:-1]) if row.balanceId is not None else None
+    return UserSnapshot(*row[:4], balance)
+
+
+class IdentityCache:
+    def __init__(self, max_entries=1024, ttl_seconds=30):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # userId -> (expiry time, UserSnapshot)
+        self._generation = 0           # bumped by every invalidation, see get()
+        self._lock = Lock()
+
+    def configure(self, max_entries, ttl_seconds):
+        """Change the cache limits, dropping every entry."""
+        with self._lock:
+            self.max_entries = max_entries
+            self.ttl_seconds = ttl_seconds
+            self._entries.clear()
+            self._generation += 1
+
+    def get(self, user_id):
+        """Return the snapshot of a user, read from the database when missing or expired, or None when the user does not exist."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+            generation = self._generation
+
+        snapshot = load_snapshot(user_id)
+        with self._lock:
+            # not stored when an invalidation happened while it was read, it may predate the change
+            if snapshot is not None and generation == self._generation and self.max_entries > 0:
+                self._entries[user_id] = (now + self.ttl_seconds, snapshot)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id=None):
+        """Drop the entry of one user, or every entry when no user is given."""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+identity_cache = IdentityCache()
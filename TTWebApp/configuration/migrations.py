@@ -0,0 +1,87 @@
+import click
+from sqlalchemy import inspect, text
+from .models import db, UsageHistory, DailyUsageRollup, Recharge, Question, Answer
+from .rollups import rebuild
+from .questionSearch import SEARCH_TABLE, create_search_index
+
+# schema upgrades for existing appDatabase.db files-----------------------------------------------------------------------------------
+# db.create_all() only creates missing tables, the columns and indexes added to tables that already exist are created here
+
+
+def upgrade_database():
+    """Create the missing tables and the missing columns and indexes of existing tables."""
+    new_rollups = not inspect(db.engine).has_table(DailyUsageRollup.__tablename__)
+    db.create_all()
+    # the rollups of the usage history recorded before the table existed
+    if new_rollups:
+        rebuild()
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        # added columns are nullable, the existing rows get NULL (e.g. precomputed predictions then count as stale)
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" '
+                                            f'{column.type.compile(dialect=db.engine.dialect)}'))
+                created.append(f'{table.name}.{column.name}')
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                created.append(index.name)
+    # full-text index of the questions, filled from the existing questions
+    if create_search_index():
+        created.append(SEARCH_TABLE)
+    return created
+
+
+# the per-user queries of the web pages and the api, they must be served by an index
+def per_user_queries(user_id=1, question_id=1):
+    return {
+        'usage history by user': UsageHistory.query.filter_by(userId=user_id),
+        'recharges by user': Recharge.query.filter_by(userId=user_id),
+        'questions by user': Question.query.filter_by(userId=user_id),
+        'answers by question': Answer.query.filter_by(questionId=question_id),
+        'latest questions': Question.query.order_by(Question.submittedAt.desc()).limit(20),
+    }
+
+
+def explain_query_plans():
+    """Return the SQLite query plan lines of every per-user query."""
+    plans = {}
+    for name, query in per_user_queries().items():
+        sql = str(query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+        plans[name] = [row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    return plans
+
+
+def full_scans(plans):
+    """Return the names of the queries whose plan scans a whole table."""
+    return [name for name, lines in plans.items()
+            if any(line.startswith('SCAN') and 'USING' not in line for line in lines)]
+
+
+def register_commands(app):
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Create the missing tables and indexes."""
+        created = upgrade_database()
+        click.echo(f"Created columns and indexes: {', '.join(created)}" if created else "Database is up to date.")
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--user-id', type=int, default=None, help="Only rebuild the rollups of this user.")
+    def rebuild_rollups_command(user_id):
+        """Recompute the daily usage rollups from the usage history."""
+        click.echo(f"Rebuilt {rebuild(user_id)} daily usage rollups.")
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """Fail if a per-user query does a full table scan."""
+        plans = explain_query_plans()
+        for name, lines in plans.items():
+            click.echo(f"{name}: {' | '.join(lines)}")
+        scans = full_scans(plans)
+        if scans:
+            raise click.ClickException(f"Full table scan in: {', '.join(scans)}")
@@ -0,0 +1,79 @@
+import pickle
+from collections import OrderedDict
+from threading import Lock
+from sqlalchemy import func, select, true
+from .models import db, UsageHistory, Recharge
+
+# in-process cache of the fitted forecast models of each user--------------------------------------------------------------------
+# an entry is only reused while the version stamp of the user's history is unchanged, entries are evicted in LRU order
+# once the cache holds more than max_entries models or more than max_bytes of (pickled) model data
+class ForecastModelCache:
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # userId -> (version, models, size)
+        self._size = 0
+        self._lock = Lock()
+
+    def configure(self, max_entries, max_bytes):
+        """Change the cache limits, evicting entries if needed."""
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, user_id, version):
+        """Return a copy of the cached models of a user, or None if missing or fitted on another history version."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                self._drop(user_id)
+                return None
+            self._entries.move_to_end(user_id)
+            # the callers complete their models, the cached dict is only replaced by put
+            return dict(entry[1])
+
+    def put(self, user_id, version, models):
+        """Store the models fitted for a user's history version."""
+        size = len(pickle.dumps(models, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            if user_id in self._entries:
+                self._drop(user_id)
+            if size > self.max_bytes:
+                return
+            self._entries[user_id] = (version, models, size)
+            self._size += size
+            self._evict()
+
+    def invalidate(self, user_id=None):
+        """Drop the entry of one user, or every entry when no user is given."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                self._size = 0
+            elif user_id in self._entries:
+                self._drop(user_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, user_id):
+        self._size -= self._entries.pop(user_id)[2]
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry[2]
+
+
+# version stamp of a user's history: row count and max id of both the usage and the recharge tables
+def history_version(user_id):
+    # both aggregates in one statement, each a subquery served by the (userId, ...) index of its table
+    usage = select(func.count(UsageHistory.id), func.max(UsageHistory.id)).where(UsageHistory.userId == user_id).subquery()
+    recharge = select(func.count(Recharge.id), func.max(Recharge.id)).where(Recharge.userId == user_id).subquery()
+    return tuple(db.session.execute(select(usage, recharge).select_from(usage.join(recharge, true()))).one())
+
+
+model_cache = ForecastModelCache()
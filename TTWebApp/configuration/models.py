@@ -18,11 +18,14 @@ class User(db.Model, UserMixin):
     rechargeHistory = db.relationship('Recharge', back_populates='user', cascade='all, delete-orphan') 
     questions = db.relationship('Question', back_populates='user', cascade='all, delete-orphan')  
     answers = db.relationship('Answer', back_populates='user', cascade='all, delete-orphan') 
+    prediction = db.relationship('Prediction', uselist=False, back_populates='user', cascade='all, delete-orphan')
+    dailyUsageRollups = db.relationship('DailyUsageRollup', cascade='all, delete-orphan')
 
 
 # history of usage, this also should be provided by the company
 class UsageHistory(db.Model):
     __tablename__ = 'usageHistory'    
+    __table_args__ = (db.Index('ix_usageHistory_userId_usageTimestamp', 'userId', 'usageTimestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Foreign key to User table
    # Timestamp for daily tracking 
@@ -35,6 +38,35 @@ class UsageHistory(db.Model):
     user = db.relationship('User', back_populates='usageHistory')
 
 
+# per user per day aggregates of the usage history, kept up to date by the usage history api (see rollups.py)
+# the histograms are json objects {value: count}, they give the median and the mode of the day
+class DailyUsageRollup(db.Model):
+    __tablename__ = 'dailyUsageRollup'
+    __table_args__ = (db.UniqueConstraint('userId', 'date', name='uq_dailyUsageRollup_userId_date'),)
+    id = db.Column(db.Integer, primary_key=True)
+    userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    eventCount = db.Column(db.Integer, nullable=False, default=0)
+    # Calls
+    callsSum = db.Column(db.Float, nullable=False, default=0)
+    callsSumSquares = db.Column(db.Float, nullable=False, default=0)
+    callsMin = db.Column(db.Float, nullable=True)
+    callsMax = db.Column(db.Float, nullable=True)
+    callsHistogram = db.Column(db.Text, nullable=False, default='{}')
+    # SMS
+    smsSum = db.Column(db.Float, nullable=False, default=0)
+    smsSumSquares = db.Column(db.Float, nullable=False, default=0)
+    smsMin = db.Column(db.Float, nullable=True)
+    smsMax = db.Column(db.Float, nullable=True)
+    smsHistogram = db.Column(db.Text, nullable=False, default='{}')
+    # Data
+    dataSum = db.Column(db.Float, nullable=False, default=0)
+    dataSumSquares = db.Column(db.Float, nullable=False, default=0)
+    dataMin = db.Column(db.Float, nullable=True)
+    dataMax = db.Column(db.Float, nullable=True)
+    dataHistogram = db.Column(db.Text, nullable=False, default='{}')
+
+
 # this table also provided by the company, stores users balance
 class Balance(db.Model):
     __tablename__ = 'balance' 
@@ -56,6 +88,7 @@ class Balance(db.Model):
 # this table is also provided by the company but since the user can purchase using this webservice, we can also add contribute to this table 
 class Recharge(db.Model):
     __tablename__ = 'recharge' 
+    __table_args__ = (db.Index('ix_recharge_userId_rechargeDate', 'userId', 'rechargeDate'),)
     id = db.Column(db.Integer, primary_key=True)
     userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     # Recharge Details
@@ -96,6 +129,8 @@ class MobileDataPlan(db.Model):
 # this table will store questions submitted by the users
 class Question(db.Model):
     __tablename__ = 'question'  
+    __table_args__ = (db.Index('ix_question_userId', 'userId'),
+                      db.Index('ix_question_submittedAt', 'submittedAt'))
     id = db.Column(db.Integer, primary_key=True) 
     userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) 
     content = db.Column(db.Text, nullable=False) 
@@ -109,6 +144,8 @@ class Question(db.Model):
 # this table will stores the answers related to each question if exist
 class Answer(db.Model):
     __tablename__ = 'answer' 
+    __table_args__ = (db.Index('ix_answer_questionId', 'questionId'),
+                      db.Index('ix_answer_userId', 'userId'))
     id = db.Column(db.Integer, primary_key=True)  
     questionId = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False) 
     userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) 
@@ -130,5 +167,39 @@ class AgencyLocation(db.Model):
     phoneNumber = db.Column(db.String(20), nullable=False)  
     latitude = db.Column(db.Float, nullable=False) 
     longitude = db.Column(db.Float, nullable=False)
-     
 
+
+# Precomputed predictions ------------------------------------------------------------------------------------------------------------------------------------
+# this table stores the forecasts computed offline by batchForecast.py, the /predict route only uses a row
+# while the history version it was computed on (row count and max id of the usage and recharge history) is unchanged
+class Prediction(db.Model):
+    __tablename__ = 'prediction'
+    id = db.Column(db.Integer, primary_key=True)
+    userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    computedAt = db.Column(db.DateTime, default=func.now(), nullable=False)
+    # History version
+    usageCount = db.Column(db.Integer, nullable=False)
+    usageMaxId = db.Column(db.Integer, nullable=True)
+    rechargeCount = db.Column(db.Integer, nullable=False)
+    rechargeMaxId = db.Column(db.Integer, nullable=True)
+    # Next day forecasts, the recharge ones are empty for users without recharge history
+    predictedCalls = db.Column(db.Float, nullable=False)
+    predictedSms = db.Column(db.Float, nullable=False)
+    predictedData = db.Column(db.Float, nullable=False)
+    predictedRechargeMonetary = db.Column(db.Float, nullable=True)
+    predictedRechargeData = db.Column(db.Float, nullable=True)
+    bonusPrediction = db.Column(db.Float, nullable=True)
+    # Recommended plans
+    bestMonetaryPlanId = db.Column(db.Integer, db.ForeignKey('monetaryRechargePlan.id'), nullable=True)
+    bestDataPlanId = db.Column(db.Integer, db.ForeignKey('mobileDataPlan.id'), nullable=True)
+    # fingerprint of the plan catalog the recommendations were chosen from
+    plansVersion = db.Column(db.String(40), nullable=True)
+    # recharge forecaster the forecasts were computed with (see predictionPipeline.forecaster_version)
+    forecaster = db.Column(db.Text, nullable=True)
+    # bonus plan of the user the bonus prediction was computed for
+    bonusPlan = db.Column(db.Integer, nullable=True)
+
+    # Relationships
+    user = db.relationship('User', back_populates='prediction')
+    bestMonetaryPlan = db.relationship('MonetaryRechargePlan')
+    bestDataPlan = db.relationship('MobileDataPlan')
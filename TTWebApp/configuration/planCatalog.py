@@ -0,0 +1,134 @@
+import hashlib
+import math
+import numpy as np
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from threading import Lock
+from sqlalchemy import func, select, true
+from .models import db, MonetaryRechargePlan, MobileDataPlan
+
+# in-process catalog of the monetary and mobile data plans, used by the plan recommendations--------------------------------------------
+# both tables are kept sorted by the amount they add (then by id), so "the smallest plan adding at least X" is a binary search
+# the catalog is rebuilt when the plan endpoints modify a table, or when the row count or max id of a table changed
+
+# lightweight copies of the plan rows, safe to share between requests (same attributes as the models)
+MonetaryPlan = namedtuple('MonetaryPlan', ['id', 'price', 'rechargeAmount', 'rechargeExpDays', 'bonusExpDays'])
+DataPlan = namedtuple('DataPlan', ['id', 'price', 'dataAmountMB', 'expDays'])
+
+MONETARY_UNIT = 0.01  # TDN, resolution of the plan combination search
+DATA_UNIT = 1.0       # MB
+MAX_COVER_UNITS = 20000  # the combination search runs on at most this many units, larger needs are searched with a coarser unit
+
+
+def _cheapest_cover(plans, amounts, needed, unit):
+    """Cheapest multiset of plans whose amounts add up to at least needed, as (price, [(plan, count)]), with an unbounded knapsack DP.
+
+    Amounts are counted in whole units, rounded down for the plans and up for the need, so the result always covers it. Needs above
+    MAX_COVER_UNITS units are counted in a coarser unit, which keeps the search bounded at the cost of a possibly dearer result, up to
+    the unit of the largest plan (ValueError above it).
+    """
+    if not needed > 0:
+        return 0.0, []
+    if needed / MAX_COVER_UNITS > unit:
+        unit = needed / MAX_COVER_UNITS
+        if unit > max(amounts, default=0):
+            raise ValueError(f"cannot search plan combinations above {MAX_COVER_UNITS * max(amounts, default=0):g}")
+    target = math.ceil(needed / unit - 1e-9)
+    # a plan adding more than the need counts as the need, so a cheapest cover adds up to less than 2 * target units
+    units = [min(int(amount / unit + 1e-9), target) for amount in amounts]
+    usable = [(plan, plan_units) for plan, plan_units in zip(plans, units) if plan_units > 0]
+    if not usable:
+        return None, []
+
+    # cost[a]: cheapest price of plans adding up to exactly a units, updated with one vectorised pass per plan: on the sums
+    # r + k * plan_units, buying the plan on top of the sum j <= k costs k * price + (cost[r + j * plan_units] - j * price)
+    size = 2 * target
+    cost = np.full(size, np.inf)
+    cost[0] = 0.0
+    for plan, plan_units in usable:
+        rows = -(-size // plan_units)
+        grid = np.full(rows * plan_units, np.inf)
+        grid[:size] = cost
+        steps = np.arange(rows)[:, None] * plan.price
+        cost = (np.minimum.accumulate(grid.reshape(rows, plan_units) - steps, axis=0) + steps).ravel()[:size]
+
+    # walk back from the cheapest sum covering the need, each step removes a plan whose price explains the cost
+    bought = Counter()
+    a = target + int(np.argmin(cost[target:]))
+    while a > 0:
+        index = min((index for index, (_, plan_units) in enumerate(usable) if plan_units <= a),
+                    key=lambda index: abs(cost[a - usable[index][1]] + usable[index][0].price - cost[a]))
+        bought[index] += 1
+        a -= usable[index][1]
+    combination = [(usable[index][0], bought[index]) for index in sorted(bought)]
+    return sum(plan.price * count for plan, count in combination), combination
+
+
+class PlanSnapshot:
+    """The plans of both tables at one version, sorted by amount, with the recommendation queries."""
+    def __init__(self, version, monetary_plans, data_plans):
+        self.version = version
+        self.monetary_plans = sorted(monetary_plans, key=lambda plan: (plan.rechargeAmount, plan.id))
+        self.data_plans = sorted(data_plans, key=lambda plan: (plan.dataAmountMB, plan.id))
+        self._monetary_amounts = [plan.rechargeAmount for plan in self.monetary_plans]
+        self._data_amounts = [plan.dataAmountMB for plan in self.data_plans]
+        # digest of the plan rows, stored with the precomputed recommendations to detect any plan change since
+        self.fingerprint = hashlib.sha1(repr((self.monetary_plans, self.data_plans)).encode()).hexdigest()
+
+    def smallest_monetary_plan(self, amount):
+        """Smallest monetary plan adding at least amount TDN (the first one by id among equal amounts), or None."""
+        i = bisect_left(self._monetary_amounts, amount)
+        return self.monetary_plans[i] if i < len(self.monetary_plans) else None
+
+    def smallest_data_plan(self, data_mb):
+        """Smallest data plan adding at least data_mb MB (the first one by id among equal amounts), or None."""
+        i = bisect_left(self._data_amounts, data_mb)
+        return self.data_plans[i] if i < len(self.data_plans) else None
+
+    def recommend(self, weekly_cost, weekly_data):
+        """Smallest monetary and data plans covering a week of predicted usage, as (monetary plan, data plan)."""
+        return self.smallest_monetary_plan(weekly_cost), self.smallest_data_plan(weekly_data)
+
+    def cheapest_per_mb(self, min_data_mb=0):
+        """Data plan with the lowest price per MB among those adding at least min_data_mb MB, or None."""
+        candidates = self.data_plans[bisect_left(self._data_amounts, min_data_mb):]
+        candidates = [plan for plan in candidates if plan.dataAmountMB > 0]
+        return min(candidates, key=lambda plan: (plan.price / plan.dataAmountMB, plan.id), default=None)
+
+    def cheapest_combination(self, cost, data_mb):
+        """Cheapest plans (each one possibly bought several times) adding at least cost TDN and data_mb MB.
+
+        Returns {'price', 'monetaryPlans', 'dataPlans'} with the plans as [(plan, count)], or None when the plans cannot cover the need.
+        Raises ValueError when the need is too large for the search.
+        """
+        monetary_price, monetary = _cheapest_cover(self.monetary_plans, self._monetary_amounts, cost, MONETARY_UNIT)
+        data_price, data = _cheapest_cover(self.data_plans, self._data_amounts, data_mb, DATA_UNIT)
+        if monetary_price is None or data_price is None:
+            return None
+        return {'price': monetary_price + data_price, 'monetaryPlans': monetary, 'dataPlans': data}
+
+
+class PlanCatalog:
+    def __init__(self):
+        self._snapshot = None
+        self._lock = Lock()
+
+    def invalidate(self):
+        """Force a rebuild on next use, called when the plans are modified."""
+        with self._lock:
+            self._snapshot = None
+
+    def snapshot(self):
+        """Return the current plans, reloading them when a plan table changed since they were loaded."""
+        monetary = select(func.count(MonetaryRechargePlan.id), func.max(MonetaryRechargePlan.id)).subquery()
+        data = select(func.count(MobileDataPlan.id), func.max(MobileDataPlan.id)).subquery()
+        version = tuple(db.session.execute(select(monetary, data).select_from(monetary.join(data, true()))).one())
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                monetary_plans = [MonetaryPlan(*row) for row in db.session.execute(select(*MonetaryRechargePlan.__table__.columns))]
+                data_plans = [DataPlan(*row) for row in db.session.execute(select(*MobileDataPlan.__table__.columns))]
+                self._snapshot = PlanSnapshot(version, monetary_plans, data_plans)
+            return self._snapshot
+
+
+plan_catalog = PlanCatalog()
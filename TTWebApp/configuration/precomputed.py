@@ -0,0 +1,52 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
+from .models import db, Prediction
+
+# read and write the forecasts precomputed by the batch job (batchForecast.py)------------------------------------------------------
+
+
+def load_prediction(user_id, version, plans_version, forecaster, bonus_plan):
+    """Return (forecast, best_monetary_plan, best_data_plan) of a user, or (None, None, None) when missing or stale."""
+    # the recommended plans are loaded in the same statement
+    prediction = Prediction.query.options(joinedload(Prediction.bestMonetaryPlan),
+                                          joinedload(Prediction.bestDataPlan)).filter_by(userId=user_id).first()
+    if prediction is None:
+        return None, None, None
+
+    # stale when the history changed, the row is too old, the plans changed since (a plan was added, modified or deleted), the
+    # recharge forecaster is another one or the bonus plan of the user changed
+    if (prediction.usageCount, prediction.usageMaxId, prediction.rechargeCount, prediction.rechargeMaxId) != tuple(version):
+        return None, None, None
+    if prediction.computedAt < datetime.now() - current_app.config['PREDICTION_MAX_AGE']:
+        return None, None, None
+    if prediction.plansVersion != plans_version:
+        return None, None, None
+    if prediction.forecaster != forecaster:
+        return None, None, None
+    if prediction.bonusPlan != bonus_plan:
+        return None, None, None
+
+    forecast = {
+        'predicted_calls': prediction.predictedCalls,
+        'predicted_sms': prediction.predictedSms,
+        'predicted_data': prediction.predictedData,
+    }
+    if prediction.predictedRechargeMonetary is not None:
+        forecast.update({
+            'predicted_recharge_monetary': prediction.predictedRechargeMonetary,
+            'predicted_recharge_data': prediction.predictedRechargeData,
+            'bonus_prediction': prediction.bonusPrediction,
+        })
+    return forecast, prediction.bestMonetaryPlan, prediction.bestDataPlan
+
+
+def store_predictions(rows):
+    """Replace the precomputed rows of the given users, rows are dicts of Prediction columns."""
+    if not rows:
+        return
+    user_ids = [row['userId'] for row in rows]
+    db.session.query(Prediction).filter(Prediction.userId.in_(user_ids)).delete(synchronize_session=False)
+    db.session.execute(insert(Prediction), rows)
+    db.session.commit()
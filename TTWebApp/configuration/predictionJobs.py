@@ -0,0 +1,129 @@
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from .modelCache import model_cache
+from .predictionPipeline import fit_models, model_version
+
+# asynchronous fitting of the /predict forecast models in a local pool of worker processes----------------------------------------------
+# the web request only loads the inputs and submits the fit, so a burst of predictions cannot hold the web workers; the page is
+# rendered by the status route once the models are fitted (they are also put in the model cache, so the page itself is cheap)
+# jobs are keyed by (user, model version): a second request for the same history and forecaster joins the job already running
+# admission control: at most max_pending jobs in flight overall and max_pending_per_user per user, beyond that submit is refused
+
+
+class JobRejected(Exception):
+    """Raised by submit when the admission limits are reached."""
+
+
+class PredictionJob:
+    def __init__(self, user_id, version, future):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.version = version
+        self.future = future
+        self.finished_at = None
+
+    def done(self):
+        return self.future.done()
+
+    def failed(self):
+        return self.future.done() and (self.future.cancelled() or self.future.exception() is not None)
+
+    def models(self):
+        """The fitted models, only once the job is done without error."""
+        return self.future.result()
+
+
+class PredictionJobs:
+    def __init__(self, workers=2, max_pending=32, max_pending_per_user=1, keep_seconds=600):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self.keep_seconds = keep_seconds  # finished jobs stay readable by the status route this long
+        self._pool = None
+        self._jobs = {}     # job id -> PredictionJob
+        self._by_key = {}   # (userId, version) -> PredictionJob
+        self._lock = Lock()
+
+    def configure(self, workers, max_pending, max_pending_per_user, keep_seconds):
+        """Change the pool size and the admission limits, the pool is restarted on next use if its size changed."""
+        with self._lock:
+            if self._pool is not None and workers != self.workers:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+            self.workers = workers
+            self.max_pending = max_pending
+            self.max_pending_per_user = max_pending_per_user
+            self.keep_seconds = keep_seconds
+
+    def submit(self, user_id, inputs):
+        """Return the job fitting the models missing from inputs (a PredictionInputs), joining an identical job when one exists."""
+        key = (user_id, model_version(inputs.version, inputs.forecaster))
+        with self._lock:
+            self._expire()
+            job = self._by_key.get(key)
+            if job is not None and not job.failed():
+                return job
+
+            pending = [job for job in self._jobs.values() if not job.done()]
+            if len(pending) >= self.max_pending:
+                raise JobRejected("Too many predictions are being computed, please try again in a moment.")
+            if sum(job.user_id == user_id for job in pending) >= self.max_pending_per_user:
+                raise JobRejected("Your previous prediction is still being computed, please wait for it to finish.")
+
+            if self._pool is None:
+                self._pool = self._new_pool()
+            arguments = (inputs.usage, inputs.recharges, *inputs.forecaster)
+            try:
+                future = self._pool.submit(fit_models, *arguments)
+            except BrokenProcessPool:
+                # a worker died (e.g. killed by the system), its pool refuses new work
+                self._pool = self._new_pool()
+                future = self._pool.submit(fit_models, *arguments)
+            job = PredictionJob(user_id, key[1], future)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+        job.future.add_done_callback(lambda future: self._finished(job))
+        return job
+
+    def get(self, job_id, user_id):
+        """Return a job of the user, or None when unknown, expired or submitted by another user."""
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            return job if job is not None and job.user_id == user_id else None
+
+    def shutdown(self):
+        """Stop the worker processes and forget every job."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._jobs.clear()
+            self._by_key.clear()
+        # outside the lock, the done callbacks of the cancelled jobs take it
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _new_pool(self):
+        # spawned workers do not inherit the threads and database connections of the web process
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _finished(self, job):
+        # runs in a thread of the pool, the fitted models go to the model cache for the next /predict of this history
+        if not job.failed():
+            models = model_cache.get(job.user_id, job.version) or {}
+            model_cache.put(job.user_id, job.version, {**models, **job.models()})
+        with self._lock:
+            job.finished_at = time.monotonic()
+
+    def _expire(self):
+        limit = time.monotonic() - self.keep_seconds
+        for job in [job for job in self._jobs.values() if job.finished_at is not None and job.finished_at < limit]:
+            del self._jobs[job.id]
+            if self._by_key.get((job.user_id, job.version)) is job:
+                del self._by_key[(job.user_id, job.version)]
+
+
+prediction_jobs = PredictionJobs()
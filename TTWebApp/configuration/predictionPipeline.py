@@ -0,0 +1,126 @@
+import json
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from flask import current_app
+from .models import Recharge
+from .forecasting import usage_frame, recharge_frame, fit_usage_models, fit_recharge_models, forecast_usage, forecast_recharge
+from .modelCache import model_cache, history_version
+from .precomputed import load_prediction
+from .historyStore import usage_columns, recharge_columns
+from .rollups import latest_usage_stats
+from .windowStats import window_statistics
+from .planCatalog import plan_catalog
+
+# the /predict page as a pipeline: one loading stage reads everything the page needs from the database, then the compute
+# stages (forecast, balance projection, plan recommendation) only work on the loaded data
+# rows are read with Core selects (the histories as NumPy columns, see historyStore.py), and the histories are only read when
+# a model has to be fitted
+
+PredictionInputs = namedtuple('PredictionInputs', [
+    'version',            # history version stamp (usage count, usage max id, recharge count, recharge max id)
+    'forecaster',         # (name, options) of the recharge forecaster set in the app config
+    'forecast',           # forecast precomputed by the batch job, or None
+    'best_plans',         # (monetary, data) plans precomputed by the batch job, or (None, None)
+    'models',             # cached fitted models of this history version and forecaster, {} when none
+    'usage',              # usageTimestamp, callsMinutes, smsCount, dataUsageMB arrays when the usage model must be fitted
+    'recharges',          # rechargeDate, rechargeAmount, bonusAdded, dataAddedMB arrays when the recharge model must be fitted
+    'balance',            # (monetaryBalance, bonusBalance, dataBalanceMB) row, or None
+    'plans',              # PlanSnapshot of the plan catalog when no precomputed recommendation exists, or None
+    'usage_stats',        # statistics of the latest day of usage and of recharges
+    'recharge_stats',
+])
+
+
+class StageTimer:
+    """Wall time of the named stages of a request, reported in the Server-Timing response header."""
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def header(self):
+        return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.timings.items())
+
+
+def load_inputs(user):
+    """Loading stage: read the history version, the precomputed or cached results and only the rows still needed."""
+    user_id = user.id
+    version = history_version(user_id)
+    usage_count, _, recharge_count, _ = version
+    forecaster = recharge_forecaster()
+    if not usage_count:
+        # nothing to forecast, the page only reports the missing history
+        return PredictionInputs(version, forecaster, None, (None, None), {}, None, None, None, None, None, None)
+
+    catalog = plan_catalog.snapshot()
+    forecast, best_monetary_plan, best_data_plan = load_prediction(user_id, version, catalog.fingerprint, forecaster_version(*forecaster),
+                                                                     user.bonusPlan)
+    models = model_cache.get(user_id, model_version(version, forecaster)) or {}
+
+    needs_usage = usage_count and forecast is None and 'usage' not in models
+    needs_recharges = recharge_count and 'recharge' not in models and (forecast is None or 'predicted_recharge_monetary' not in forecast)
+    needs_plans = best_monetary_plan is None and best_data_plan is None
+
+    usage = usage_columns(user_id, ['usageTimestamp', 'callsMinutes', 'smsCount', 'dataUsageMB']) if needs_usage else None
+    recharges = recharge_columns(user_id, ['rechargeDate', 'rechargeAmount', 'bonusAdded', 'dataAddedMB']) if needs_recharges else None
+    # the balance comes with the logged-in user (see identityCache.py)
+    balance = (user.balance.monetaryBalance, user.balance.bonusBalance, user.balance.dataBalanceMB) if user.balance else None
+    plans = catalog if needs_plans else None
+
+    usage_stats = latest_usage_stats(user_id)
+    recharge_stats = window_statistics(user_id, Recharge.rechargeDate,
+                                       {'recharge': Recharge.rechargeAmount, 'data_recharge': Recharge.dataAddedMB}) if recharge_count else None
+
+    return PredictionInputs(version, forecaster, forecast, (best_monetary_plan, best_data_plan), models, usage, recharges, balance,
+                            plans, usage_stats, recharge_stats)
+
+
+def recharge_forecaster():
+    """Backend and options of the recharge models set in the app config, as (name, options)."""
+    return current_app.config['RECHARGE_FORECASTER'], current_app.config['RECHARGE_FORECASTER_OPTIONS']
+
+
+def forecaster_version(name, options):
+    """Stamp of a recharge forecaster, stored with the forecasts precomputed by it."""
+    return f"{name} {json.dumps(options or {}, sort_keys=True, default=repr)}"
+
+
+def model_version(version, forecaster):
+    """Model cache key of a history version fitted with a forecaster ((name, options)), the models of another forecaster are stale."""
+    return tuple(version), forecaster_version(*forecaster)
+
+
+def fit_models(usage, recharges, forecaster='random_forest', options=None):
+    """Fit the models of the histories loaded by load_inputs (None when a model is not needed), as {'usage': ..., 'recharge': ...}."""
+    # also run in the worker processes of the prediction jobs, so it only takes picklable values and no app context
+    models = {}
+    if usage is not None:
+        models['usage'] = fit_usage_models(usage_frame(usage))
+    if recharges is not None:
+        models['recharge'] = fit_recharge_models(recharge_frame(recharges), forecaster, options)
+    return models
+
+
+def needs_fit(inputs):
+    """True when compute_forecast has a model to fit, i.e. the history was loaded."""
+    return inputs.usage is not None or inputs.recharges is not None
+
+
+def compute_forecast(user_id, inputs, bonus_plan):
+    """Forecast stage: the precomputed forecast, completed with the cached or newly fitted models (which are then cached)."""
+    models = inputs.models
+    if needs_fit(inputs):
+        models = {**models, **fit_models(inputs.usage, inputs.recharges, *inputs.forecaster)}
+        model_cache.put(user_id, model_version(inputs.version, inputs.forecaster), models)
+
+    forecast = dict(inputs.forecast) if inputs.forecast is not None else forecast_usage(models['usage'])
+    if inputs.version[2] and 'predicted_recharge_monetary' not in forecast:
+        forecast.update(forecast_recharge(models['recharge'], bonus_plan))
+    return forecast
@@ -0,0 +1,43 @@
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from .dbInitialization import db
+
+# SQL statement budgets of the web pages, checked in test mode (TESTING or QUERY_BUDGET_CHECKS)--------------------------------------------
+# the statements run while serving a request are counted, a view decorated with @query_budget(n) raises QueryBudgetExceeded
+# when it issues more than n of them, e.g. when a template lazily loads a relationship for every row it renders
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised after a request that issued more statements than the budget of its view."""
+
+
+def query_budget(statements):
+    """Decorator of a view, the maximum number of statements of one request."""
+    def decorator(view):
+        view.query_budget = statements
+        return view
+    return decorator
+
+
+def install_query_budget(app):
+    """Count the statements of every request and check the budgets of the views, in an app context."""
+    def count_statement(*_):
+        if has_request_context():
+            g.statements = g.get('statements', 0) + 1
+
+    for engine in db.engines.values():
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+    @app.before_request
+    def reset_statement_count():
+        # g outlives the request when an app context was already pushed, e.g. by a test in a with app.app_context() block
+        g.statements = 0
+
+    @app.after_request
+    def check_query_budget(response):
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        statements = g.get('statements', 0)
+        if budget is not None and statements > budget:
+            raise QueryBudgetExceeded(f"{request.endpoint} issued {statements} SQL statements, its budget is {budget}")
+        return response
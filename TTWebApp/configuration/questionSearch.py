@@ -0,0 +1,79 @@
+import re
+from sqlalchemy import DDL, event, inspect, select, text
+from sqlalchemy.orm import joinedload
+from .models import db, Question
+
+# full-text search of the community questions--------------------------------------------------------------------------------------------
+# on SQLite the questions are indexed by the FTS5 table question_fts, an external content table (it only stores the index, the
+# text stays in question) kept in sync by triggers on question; a search reads the index entries of its words, ranks the matches
+# with bm25 and reads one page of them, so its cost follows the number of matches and not the number of questions
+# other databases, and SQLite databases not upgraded yet (flask --app app upgrade-db), fall back to a LIKE scan, newest first
+
+SEARCH_TABLE = 'question_fts'
+
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS question_fts USING fts5("
+    "content, content='question', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS question_fts_insert AFTER INSERT ON question BEGIN "
+    "INSERT INTO question_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS question_fts_delete AFTER DELETE ON question BEGIN "
+    "INSERT INTO question_fts(question_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS question_fts_update AFTER UPDATE OF content ON question BEGIN "
+    "INSERT INTO question_fts(question_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO question_fts(rowid, content) VALUES (new.id, new.content); END",
+]
+
+# new databases get the index with the question table (db.create_all)
+for statement in SEARCH_DDL:
+    event.listen(Question.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+_indexed_engines = set()
+
+
+def create_search_index():
+    """Create the search index of an existing SQLite database and index its questions, returns False when there is nothing to do."""
+    if db.engine.dialect.name != 'sqlite' or inspect(db.engine).has_table(SEARCH_TABLE):
+        return False
+    with db.engine.begin() as connection:
+        for statement in SEARCH_DDL:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO question_fts(question_fts) VALUES ('rebuild')"))
+    return True
+
+
+def uses_search_index():
+    if db.engine.url in _indexed_engines:
+        return True
+    if db.engine.dialect.name == 'sqlite' and inspect(db.engine).has_table(SEARCH_TABLE):
+        _indexed_engines.add(db.engine.url)
+        return True
+    return False
+
+
+def match_expression(keyword):
+    """FTS5 query matching the questions containing every word of keyword, the last one as a prefix, or None without words."""
+    # every word is quoted, the FTS5 operators and special characters of the keyword are not interpreted
+    words = re.findall(r'\w+', keyword)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+def search_questions(keyword, offset=0, limit=20):
+    """Questions matching keyword (with their user), best match first, as (questions, offset of the next page or None)."""
+    if uses_search_index():
+        expression = match_expression(keyword)
+        if expression is None:
+            return [], None
+        ids = db.session.execute(text("SELECT rowid FROM question_fts WHERE question_fts MATCH :expression "
+                                      "ORDER BY rank LIMIT :limit OFFSET :offset"),
+                                 {'expression': expression, 'limit': limit + 1, 'offset': offset}).scalars().all()
+    else:
+        ids = db.session.execute(select(Question.id).where(Question.content.ilike(f'%{keyword}%'))
+                                 .order_by(Question.id.desc()).limit(limit + 1).offset(offset)).scalars().all()
+
+    next_offset = offset + limit if len(ids) > limit else None
+    ids = ids[:limit]
+    questions = {question.id: question
+                 for question in Question.query.options(joinedload(Question.user)).filter(Question.id.in_(ids))}
+    return [questions[id] for id in ids if id in questions], next_offset
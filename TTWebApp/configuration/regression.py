@@ -0,0 +1,46 @@
+import numpy as np
+
+# closed-form simple linear regression, used instead of sklearn's LinearRegression for the single feature usage models
+# every target is a column of Y, so calls, sms and data are fitted together in one pass
+
+
+def fit_lines(x, Y):
+    """Least-squares slope and intercept of every column of Y against x, returns (slopes, intercepts)."""
+    x = np.asarray(x, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64).reshape(len(x), -1)
+
+    x_mean = x.mean()
+    y_mean = Y.mean(axis=0)
+    xc = x - x_mean
+    sxx = xc @ xc
+
+    # a single distinct x value has no slope, the fit is then the mean of y (same as sklearn)
+    slopes = (xc @ (Y - y_mean)) / sxx if sxx > 0 else np.zeros(Y.shape[1])
+    return slopes, y_mean - slopes * x_mean
+
+
+def fit_lines_grouped(groups, x, Y):
+    """Fit one line per group for every column of Y, returns (group keys, slopes, intercepts) with one row per group."""
+    x = np.asarray(x, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64).reshape(len(x), -1)
+    keys, inverse = np.unique(groups, return_inverse=True)
+    n_groups = len(keys)
+
+    counts = np.bincount(inverse, minlength=n_groups)
+    x_mean = np.bincount(inverse, weights=x, minlength=n_groups) / counts
+    y_mean = np.stack([np.bincount(inverse, weights=Y[:, j], minlength=n_groups) for j in range(Y.shape[1])], axis=1) / counts[:, None]
+
+    # center on the group means before the reductions to keep the sums well conditioned
+    xc = x - x_mean[inverse]
+    Yc = Y - y_mean[inverse]
+    sxx = np.bincount(inverse, weights=xc * xc, minlength=n_groups)
+    sxy = np.stack([np.bincount(inverse, weights=xc * Yc[:, j], minlength=n_groups) for j in range(Y.shape[1])], axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = np.where(sxx[:, None] > 0, sxy / sxx[:, None], 0.0)
+    return keys, slopes, y_mean - slopes * x_mean[:, None]
+
+
+def predict_lines(slopes, intercepts, x):
+    """Evaluate the fitted lines at x."""
+    return intercepts + slopes * x
@@ -0,0 +1,190 @@
+import json
+import math
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import func, insert, literal_column
+from .dbInitialization import UPSERT_DIALECTS
+from .models import db, UsageHistory, DailyUsageRollup
+
+# daily usage rollups: per user per day count, sums, sums of squares, min/max and value histograms of the usage columns--------------
+# the usage history api adds every new record to its day, so the prediction page reads one row per day instead of every event
+
+# rollup column prefix -> usage history column, and the prefix of the statistics shown by the prediction page
+ROLLUP_FIELDS = {'calls': 'callsMinutes', 'sms': 'smsCount', 'data': 'dataUsageMB'}
+STATS_PREFIX = {'calls': 'calls', 'sms': 'sms', 'data': 'data_usage'}
+INTEGER_FIELDS = {'calls', 'sms'}
+
+# the upsert of add_usage merges the new day states into the stored rows in SQL: sums are added, min/max kept and the
+# histograms merged key by key, per dialect (two-argument min/max of SQLite are least/greatest in PostgreSQL)
+EXTREME_FUNCTIONS = {'sqlite': ('min', 'max'), 'postgresql': ('least', 'greatest')}
+HISTOGRAM_MERGE = {
+    'sqlite': "(SELECT json_group_object(key, total) FROM (SELECT key, sum(value) AS total FROM "
+              "(SELECT key, value FROM json_each({old}) UNION ALL SELECT key, value FROM json_each({new})) GROUP BY key))",
+    'postgresql': "(SELECT CAST(jsonb_object_agg(key, total) AS TEXT) FROM (SELECT key, sum(CAST(value AS NUMERIC)) AS total FROM "
+                  "(SELECT key, value FROM jsonb_each_text(CAST({old} AS JSONB)) UNION ALL "
+                  "SELECT key, value FROM jsonb_each_text(CAST({new} AS JSONB))) AS pairs GROUP BY key) AS totals)",
+}
+
+
+def _empty_state(user_id, day):
+    state = {'userId': user_id, 'date': day, 'eventCount': 0}
+    for prefix in ROLLUP_FIELDS:
+        state.update({f'{prefix}Sum': 0.0, f'{prefix}SumSquares': 0.0, f'{prefix}Min': None, f'{prefix}Max': None,
+                      f'{prefix}Histogram': '{}'})
+    return state
+
+
+def _accumulate(state, records):
+    """Add usage records (dicts or rows with the usage history columns) to the state of their day."""
+    state['eventCount'] += len(records)
+    for prefix, field in ROLLUP_FIELDS.items():
+        values = [float(record[field] or 0) for record in records]
+        state[f'{prefix}Sum'] += sum(values)
+        state[f'{prefix}SumSquares'] += sum(value * value for value in values)
+        low, high = min(values), max(values)
+        state[f'{prefix}Min'] = low if state[f'{prefix}Min'] is None else min(state[f'{prefix}Min'], low)
+        state[f'{prefix}Max'] = high if state[f'{prefix}Max'] is None else max(state[f'{prefix}Max'], high)
+        histogram = json.loads(state[f'{prefix}Histogram'])
+        for value in values:
+            histogram[repr(value)] = histogram.get(repr(value), 0) + 1
+        state[f'{prefix}Histogram'] = json.dumps(histogram)
+    return state
+
+
+def _group_by_day(records):
+    days = defaultdict(list)
+    for record in records:
+        days[(record['userId'], record['usageTimestamp'].date())].append(record)
+    return days
+
+
+def rollup_upsert():
+    """INSERT of day states merged into the existing rollup of their (userId, date) by ON CONFLICT DO UPDATE."""
+    table = DailyUsageRollup.__table__
+    dialect = db.engine.dialect.name
+    statement = UPSERT_DIALECTS[dialect](table)
+    excluded = statement.excluded
+    smaller, larger = (getattr(func, name) for name in EXTREME_FUNCTIONS[dialect])
+    values = {'eventCount': table.c.eventCount + excluded.eventCount}
+    for prefix in ROLLUP_FIELDS:
+        for column in [f'{prefix}Sum', f'{prefix}SumSquares']:
+            values[column] = table.c[column] + excluded[column]
+        low, high = f'{prefix}Min', f'{prefix}Max'
+        values[low] = smaller(func.coalesce(table.c[low], excluded[low]), func.coalesce(excluded[low], table.c[low]))
+        values[high] = larger(func.coalesce(table.c[high], excluded[high]), func.coalesce(excluded[high], table.c[high]))
+        histogram = f'{prefix}Histogram'
+        values[histogram] = literal_column(HISTOGRAM_MERGE[dialect].format(old=f'"{table.name}"."{histogram}"',
+                                                                           new=f'excluded."{histogram}"'))
+    return statement.on_conflict_do_update(index_elements=['userId', 'date'], set_=values)
+
+
+def add_usage(records):
+    """Add new usage records to their daily rollups, in the current transaction (the caller commits)."""
+    # one executemany upsert of the day states of the batch, the database adds them to the stored rollups atomically, so
+    # concurrent writers of a day neither lose an update nor race on the first insert of the day
+    states = [_accumulate(_empty_state(user_id, day), day_records) for (user_id, day), day_records in _group_by_day(records).items()]
+    if states:
+        db.session.execute(rollup_upsert(), states)
+
+
+def refresh_day(user_id, day):
+    """Recompute the rollup of one day from the usage history, e.g. after a record was deleted (the caller commits)."""
+    DailyUsageRollup.query.filter_by(userId=user_id, date=day).delete()
+    records = [record._mapping for record in db.session.query(UsageHistory.userId, UsageHistory.usageTimestamp, UsageHistory.callsMinutes,
+                                                              UsageHistory.smsCount, UsageHistory.dataUsageMB)
+               .filter(UsageHistory.userId == user_id, UsageHistory.usageTimestamp >= day,
+                       UsageHistory.usageTimestamp < day + timedelta(days=1))]
+    if records:
+        db.session.add(DailyUsageRollup(**_accumulate(_empty_state(user_id, day), records)))
+
+
+def rebuild(user_id=None):
+    """Recompute the rollups of one user, or of everyone, from the whole usage history."""
+    rollups = DailyUsageRollup.query
+    usage = db.session.query(UsageHistory.userId, UsageHistory.usageTimestamp, UsageHistory.callsMinutes,
+                             UsageHistory.smsCount, UsageHistory.dataUsageMB)
+    if user_id is not None:
+        rollups = rollups.filter_by(userId=user_id)
+        usage = usage.filter(UsageHistory.userId == user_id)
+    rollups.delete()
+
+    states = {}
+    for (key_user_id, day), records in _group_by_day(record._mapping for record in usage.yield_per(10000)).items():
+        states[(key_user_id, day)] = _accumulate(_empty_state(key_user_id, day), records)
+    if states:
+        db.session.execute(insert(DailyUsageRollup.__table__), list(states.values()))
+    db.session.commit()
+    return len(states)
+
+
+def rollup_stats(rollup):
+    """Mean, std, median and mode of every usage column of a rollup, named like the prediction page expects."""
+    count = rollup.eventCount
+    stats = {'date': rollup.date}
+    for prefix, label in STATS_PREFIX.items():
+        total = getattr(rollup, f'{prefix}Sum')
+        mean = total / count
+        # sample standard deviation, undefined for a single event like in pandas
+        variance = (getattr(rollup, f'{prefix}SumSquares') - total * mean) / (count - 1) if count > 1 else math.nan
+        histogram = sorted((float(value), occurrences) for value, occurrences in json.loads(getattr(rollup, f'{prefix}Histogram')).items())
+
+        stats[f'{label}_mean'] = mean
+        stats[f'{label}_std'] = math.sqrt(max(variance, 0.0)) if count > 1 else math.nan
+        stats[f'{label}_median'] = _histogram_median(histogram, count)
+        # the smallest of the most frequent values, like pandas mode().iloc[0]
+        mode = max(histogram, key=lambda item: (item[1], -item[0]))[0]
+        stats[f'{label}_mode'] = int(mode) if prefix in INTEGER_FIELDS else mode
+    return stats
+
+
+def _histogram_median(histogram, count):
+    middle = [(count - 1) // 2, count // 2]
+    values = []
+    seen = 0
+    for value, occurrences in histogram:
+        while middle and middle[0] < seen + occurrences:
+            values.append(value)
+            middle.pop(0)
+        seen += occurrences
+    return sum(values) / 2
+
+
+def _merge(user_id, day, rollups):
+    """Combine the rollups of several days into one rollup of the window, not added to the session."""
+    state = _empty_state(user_id, day)
+    for rollup in rollups:
+        state['eventCount'] += rollup.eventCount
+        for prefix in ROLLUP_FIELDS:
+            state[f'{prefix}Sum'] += getattr(rollup, f'{prefix}Sum')
+            state[f'{prefix}SumSquares'] += getattr(rollup, f'{prefix}SumSquares')
+            state[f'{prefix}Min'] = min(value for value in (state[f'{prefix}Min'], getattr(rollup, f'{prefix}Min')) if value is not None)
+            state[f'{prefix}Max'] = max(value for value in (state[f'{prefix}Max'], getattr(rollup, f'{prefix}Max')) if value is not None)
+            histogram = json.loads(state[f'{prefix}Histogram'])
+            for value, occurrences in json.loads(getattr(rollup, f'{prefix}Histogram')).items():
+                histogram[value] = histogram.get(value, 0) + occurrences
+            state[f'{prefix}Histogram'] = json.dumps(histogram)
+    return DailyUsageRollup(**state)
+
+
+def latest_usage_stats(user_id, days=1):
+    """Statistics of the user's last `days` days of usage, ending at their newest day, or None without usage history."""
+    newest = db.session.query(func.max(DailyUsageRollup.date)).filter(DailyUsageRollup.userId == user_id).scalar()
+    if newest is None:
+        return _history_stats(user_id, days)
+
+    rollups = DailyUsageRollup.query.filter(DailyUsageRollup.userId == user_id,
+                                            DailyUsageRollup.date >= newest - timedelta(days=days - 1)).all()
+    return rollup_stats(rollups[0] if len(rollups) == 1 else _merge(user_id, newest, rollups))
+
+
+def _history_stats(user_id, days):
+    # usage recorded without rollups (e.g. written directly to the database): the days are summarized from the usage history,
+    # nothing is written on this read path (flask rebuild-rollups stores them)
+    newest = db.session.query(func.max(UsageHistory.usageTimestamp)).filter(UsageHistory.userId == user_id).scalar()
+    if newest is None:
+        return None
+    newest = newest.date()
+    records = [record._mapping for record in db.session.query(UsageHistory.userId, UsageHistory.usageTimestamp, UsageHistory.callsMinutes,
+                                                              UsageHistory.smsCount, UsageHistory.dataUsageMB)
+               .filter(UsageHistory.userId == user_id, UsageHistory.usageTimestamp >= newest - timedelta(days=days - 1))]
+    return rollup_stats(DailyUsageRollup(**_accumulate(_empty_state(user_id, newest), records)))
@@ -0,0 +1,46 @@
+import os
+from datetime import timedelta
+
+# default settings of the web application, create_application() loads them, then the TTAPP_* environment variables (e.g.
+# TTAPP_SQLALCHEMY_DATABASE_URI=postgresql://..., values are parsed as JSON when possible), then its config argument
+
+
+class Config:
+    SECRET_KEY = 'TTapp'
+    # relative SQLite paths are in the instance folder, DATABASE_URL is honoured like on most hosting platforms
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///appDatabase.db')
+    # connection pool of the engine, the pre-ping and the recycling only apply to server databases (not SQLite)
+    DATABASE_POOL_SIZE = 5
+    DATABASE_MAX_OVERFLOW = 10
+    DATABASE_POOL_PRE_PING = True
+    DATABASE_POOL_RECYCLE = 1800
+    # pragmas run on every new SQLite connection, None leaves the SQLite default
+    # in WAL mode the readers do not wait for the writers (e.g. the bulk ingestion of the api), and NORMAL is durable with WAL
+    SQLITE_JOURNAL_MODE = 'WAL'
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+    # SQL statement budgets of the pages (see queryBudget.py), always checked when TESTING is set
+    QUERY_BUDGET_CHECKS = False
+    # fitted forecast models kept in memory between /predict requests
+    MODEL_CACHE_MAX_ENTRIES = 256
+    MODEL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    # snapshots of the logged-in users and their balances, read on every authenticated request
+    # the api write endpoints invalidate them, the TTL bounds the staleness of changes made by other processes
+    IDENTITY_CACHE_MAX_ENTRIES = 1024
+    IDENTITY_CACHE_TTL_SECONDS = 30
+    # rows of the prediction table older than this are recomputed live
+    PREDICTION_MAX_AGE = timedelta(days=1)
+    # rows inserted per transaction by the bulk ingestion of the api
+    BULK_CHUNK_SIZE = 5000
+    # /predict fits the missing forecast models in worker processes and the page is served once they are ready
+    PREDICT_ASYNC = True
+    PREDICT_WORKERS = 2
+    # admission control of the prediction jobs: jobs in flight overall and per user
+    PREDICT_MAX_PENDING = 32
+    PREDICT_MAX_PENDING_PER_USER = 1
+    # seconds a finished prediction job stays readable by its status page
+    PREDICT_JOB_KEEP_SECONDS = 600
+    # backend of the recharge forecasts (see forecasters.py) and its constructor options
+    RECHARGE_FORECASTER = 'random_forest'
+    RECHARGE_FORECASTER_OPTIONS = {}
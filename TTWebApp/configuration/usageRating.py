@@ -0,0 +1,123 @@
+import numpy as np
+from sqlalchemy import and_, bindparam, select, update
+from .models import db, Balance
+
+# rating of usage events against the balances (POST /api/usageHistory/rate)--------------------------------------------------------------
+# the charging rule of dataSimulation/simulate.py: an event costs callsMinutes * CALL_RATE + smsCount * SMS_RATE, paid from the bonus
+# balance first and the monetary balance for the rest, and an event the two balances cannot pay is rejected (the later events of
+# the user are still rated); data usage is not charged
+# a batch is rated with NumPy: the events are grouped by user in timestamp order and the cumulative costs of each user are compared
+# with its funds, the first event over the funds is rejected and the events after it are rated again with what is left (after
+# MAX_ROUNDS rounds the events left are rated one by one); the balances are then written with one executemany UPDATE of the amounts
+# spent, guarded by the values read
+
+CALL_RATE = 0.035
+SMS_RATE = 0.025
+# rounding allowance of the cumulative sums against the sequential subtractions of the rule
+TOLERANCE = 1e-9
+# each round rejects one event per user at least, so a crafted batch could need about as many rounds as events
+MAX_ROUNDS = 8
+
+
+class RatingConflict(Exception):
+    """Raised when a balance changed between its read and the update of a rating batch."""
+
+
+def event_costs(calls_minutes, sms_counts):
+    return np.asarray(calls_minutes, dtype=np.float64) * CALL_RATE + np.asarray(sms_counts, dtype=np.float64) * SMS_RATE
+
+
+def waterfall(user_ids, timestamps, costs, funds):
+    """Rate events (arrays of the same length) against funds ({userId: (bonus, monetary)}), returns the mask of the accepted events
+    and the amounts spent as {userId: (bonus spent, monetary spent)}, the events of users without funds are rejected.
+
+    Raises ValueError when a cost is negative or not finite, such an event would credit the balances.
+    """
+    count = len(costs)
+    order = np.lexsort((np.arange(count), timestamps, user_ids))
+    users = np.asarray(user_ids)[order]
+    cost = np.asarray(costs, dtype=np.float64)[order]
+    if not np.all(np.isfinite(cost) & (cost >= 0)):
+        raise ValueError("usage events must have a finite non-negative cost")
+    new_user = np.r_[True, users[1:] != users[:-1]] if count else np.zeros(0, dtype=bool)
+    starts = np.flatnonzero(new_user)
+    group = np.cumsum(new_user) - 1
+    group_users = users[starts].tolist()
+    available = np.array([sum(funds[user]) if user in funds else -1.0 for user in group_users])
+
+    position = np.arange(count)
+    accepted = np.zeros(count, dtype=bool)
+    pending = np.ones(count, dtype=bool)
+    spent = np.zeros(len(starts))
+    for _ in range(MAX_ROUNDS):
+        if not pending.any():
+            break
+        # funds only decrease, an event costing more than what is left can never be paid
+        left = (available - spent)[group]
+        pending &= cost <= left + TOLERANCE
+        pending_cost = np.where(pending, cost, 0.0)
+        total = np.cumsum(pending_cost)
+        cumulative = total - (total[starts] - pending_cost[starts])[group]
+        over = pending & (cumulative > left + TOLERANCE)
+        first_over = np.minimum.reduceat(np.where(over, position, count), starts)[group]
+
+        paid = pending & (position < first_over)
+        accepted |= paid
+        spent += np.bincount(group, weights=np.where(paid, cost, 0.0), minlength=len(starts))
+        # the first event over the funds is rejected, the events after it are rated in the next round
+        pending &= position > first_over
+    else:
+        # the same rule one event at a time, in (user, timestamp) order
+        for index in np.flatnonzero(pending).tolist():
+            user_group = group[index]
+            if cost[index] <= available[user_group] - spent[user_group] + TOLERANCE:
+                accepted[index] = True
+                spent[user_group] += cost[index]
+
+    result = np.empty(count, dtype=bool)
+    result[order] = accepted
+    spending = {}
+    for user, amount in zip(group_users, spent.tolist()):
+        if user in funds and amount > 0:
+            bonus, monetary = funds[user]
+            from_bonus = min(bonus, amount)
+            spending[user] = (from_bonus, min(amount - from_bonus, monetary))
+    return result, spending
+
+
+def read_funds(user_ids):
+    rows = db.session.execute(select(Balance.userId, Balance.bonusBalance, Balance.monetaryBalance)
+                              .where(Balance.userId.in_(user_ids)))
+    return {user_id: (bonus, monetary) for user_id, bonus, monetary in rows}
+
+
+def debit_statement():
+    table = Balance.__table__
+    # the guards fail when the balance changed since it was read
+    return (update(table)
+            .where(and_(table.c.userId == bindparam('user_id'), table.c.bonusBalance == bindparam('bonus_read'),
+                        table.c.monetaryBalance == bindparam('monetary_read')))
+            .values(bonusBalance=table.c.bonusBalance - bindparam('bonus_spent'),
+                    monetaryBalance=table.c.monetaryBalance - bindparam('monetary_spent')))
+
+
+def rate_usage(rows):
+    """Charge usage rows ({'userId', 'usageTimestamp', 'callsMinutes', 'smsCount', ...}) to the balances in the current transaction,
+    returns the mask of the accepted rows and the amounts spent per user, raises RatingConflict when a balance changed meanwhile."""
+    if not rows:
+        return np.zeros(0, dtype=bool), {}
+    user_ids = np.array([row['userId'] for row in rows])
+    timestamps = np.array([row['usageTimestamp'] for row in rows], dtype='datetime64[us]')
+    costs = event_costs([row['callsMinutes'] for row in rows], [row['smsCount'] for row in rows])
+
+    funds = read_funds(np.unique(user_ids).tolist())
+    accepted, spending = waterfall(user_ids, timestamps, costs, funds)
+    if spending:
+        result = db.session.execute(debit_statement(), [
+            {'user_id': user_id, 'bonus_read': funds[user_id][0], 'monetary_read': funds[user_id][1],
+             'bonus_spent': bonus, 'monetary_spent': monetary}
+            for user_id, (bonus, monetary) in spending.items()
+        ])
+        if result.rowcount != len(spending):
+            raise RatingConflict("A balance changed while the usage was rated, please retry.")
+    return accepted, spending
@@ -0,0 +1,35 @@
+from datetime import datetime, time, timedelta
+import numpy as np
+from sqlalchemy import func
+from .models import db
+from .groupStats import STATISTICS, group_statistics
+
+# statistics of the latest days of a user's history------------------------------------------------------------------------------------
+# the newest date is read with MAX(date column) on the (userId, date) index and only the rows of the window are loaded,
+# so the work grows with the activity of the window instead of the length of the history
+
+
+def window_bounds(user_id, date_column, days=1):
+    """Return (first day, newest day) of the user's last `days` days of history, or (None, None) without dated rows."""
+    newest = db.session.query(func.max(date_column)).filter(date_column.class_.userId == user_id).scalar()
+    if newest is None:
+        return None, None
+    newest = newest.date() if isinstance(newest, datetime) else newest
+    return newest - timedelta(days=days - 1), newest
+
+
+def window_statistics(user_id, date_column, columns, days=1):
+    """Mean, std, median and mode of each {prefix: column} over the user's last `days` days, or None without history."""
+    first, newest = window_bounds(user_id, date_column, days)
+    if newest is None:
+        return None
+
+    start = datetime.combine(first, time.min) if isinstance(date_column.type, db.DateTime) else first
+    rows = db.session.query(*columns.values()).filter(date_column.class_.userId == user_id, date_column >= start).all()
+    _, statistics = group_statistics(np.zeros(len(rows), dtype=np.int64),
+                                     {prefix: [row[i] for row in rows] for i, prefix in enumerate(columns)})
+
+    window = {'date': newest, 'from': first}
+    for prefix, column_statistics in statistics.items():
+        window.update({f'{prefix}_{statistic}': column_statistics[statistic][0].item() for statistic in STATISTICS})
+    return window